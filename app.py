@@ -8,33 +8,103 @@ This file focuses on the UI orchestration and column layout.
 # ---------------------------------------------------------------------------
 # Imports & initialisation
 # ---------------------------------------------------------------------------
-import os, tempfile, io, re, time
-import pandas as pd
+import os, io, re, json, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from dotenv import load_dotenv
-from google import genai
-from monday_dot_com_interface import MondayDotComInterface
-
-from utils import (
-    reset_app_state,
-    is_rate_limit_error,
-    gemini_api_with_retry,
-    query_llm,
-    extract_text_from_email,
-    process_eml_file,
-    process_msg_file,
-    process_pdf_with_gemini,
-    extract_project_name_from_content,
-    extract_parameters_from_monday_project,
-    map_tapered_insulation_value,
-)
-from constants import DEFAULT_QUERY
+
+from constants import DEFAULT_QUERY, FILE_SEPARATOR, GEMINI_MODEL, PARAM_NAMES, REASON_FOR_CHANGE_INSTRUCTION
+
+if TYPE_CHECKING:
+    from monday_dot_com_interface import MondayDotComInterface
+
+# utils (and the google-genai SDK it pulls in) is imported inside the functions
+# that need it, so the upload UI paints before those modules have loaded
 
 # ── env / clients ───────────────────────────────────────────────────────────
 load_dotenv()
-client               = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
 MONDAY_API_TOKEN     = os.getenv("MONDAY_API_TOKEN")
-monday_interface     = MondayDotComInterface(MONDAY_API_TOKEN) if MONDAY_API_TOKEN else None
+
+
+@st.cache_resource
+def get_monday_interface() -> "MondayDotComInterface | None":
+    """One Monday.com interface per server process, shared by every rerun/session (Gemini calls go through utils' client)."""
+    from monday_dot_com_interface import MondayDotComInterface
+
+    return MondayDotComInterface(MONDAY_API_TOKEN) if MONDAY_API_TOKEN else None
+
+
+MAX_FILE_WORKERS     = 8   # uploads processed concurrently (bounded for Gemini rate limits)
+CHAT_MODEL           = GEMINI_MODEL
+XLSX_CELL_MAX_CHARS  = 32767   # Excel's limit on text in one cell
+SUBJECT_MATCH_MIN_SIMILARITY = 0.85   # Monday.com score at which a subject-line project name is trusted
+
+# DEFAULT_QUERY with the structured "Reason for Change" field pinned, per enquiry type
+_QUERY_VARIANTS = {
+    et: DEFAULT_QUERY.replace(REASON_FOR_CHANGE_INSTRUCTION, f"Reason for Change: ({et})")
+    for et in ("Amendment", "New Enquiry")
+}
+
+# ── response-parsing patterns (compiled once, not per rerun) ───────────────
+# keys are anchored to a line start (after any list / quote / heading markers),
+# so the engine only tries line starts instead of every offset
+_KEY_PREFIX     = r"^[ \t>*#\d.)-]*"
+PARAM_PATTERN   = re.compile(
+    _KEY_PREFIX + r"(?P<key>" + "|".join(re.escape(n) for n in PARAM_NAMES) + r"):?[ \t]*(?P<val>[^\n]*)", re.I | re.M
+)
+_PARAM_CANON    = {n.lower(): n for n in PARAM_NAMES}   # matched key (any case) -> canonical name
+_PARAM_VALUE    = re.compile(rb":?[ \t]*([^\n]*)")         # value following a key found by Hyperscan
+_LEADING_STARS  = re.compile(r'^\*+\s*')
+_POSTCODE_CLEAN = re.compile(r'^\s*of Project Location:?\*?\s*', re.I)
+_NOT_PROVIDED   = re.compile(r'not\s+provided|not\s+found|none', re.I)
+_UK_POSTCODE    = re.compile(r'([A-Z]{1,2})[0-9]')
+# project name candidate: the Subject text after any leading "RE:"/"FW:"/"FWD:" and [tag] prefixes, before any (...) or [...]
+_SUBJECT_NAME   = re.compile(r'^Subject:[ \t]*(?:(?:RE|FWD?)[ \t]*:[ \t]*|\[[^\]\n]*\][ \t]*)*(?P<name>[^\n(\[]*)', re.M | re.I)
+
+# optional Hyperscan database: one DFA scan finds every key at once; PARAM_PATTERN is the fallback
+try:
+    import hyperscan
+
+    _PARAM_DB = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+    _PARAM_DB.compile(
+        expressions=[(_KEY_PREFIX + re.escape(n)).encode() for n in PARAM_NAMES],
+        ids=list(range(len(PARAM_NAMES))),
+        elements=len(PARAM_NAMES),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_MULTILINE | hyperscan.HS_FLAG_SOM_LEFTMOST] * len(PARAM_NAMES),
+    )
+except Exception:
+    _PARAM_DB = None
+
+# ---------------------------------------------------------------------------
+# CACHED LOOKUPS (identical inputs are served from memory for an hour)
+# ---------------------------------------------------------------------------
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_project_name(email_text: str, attachments_data: list, all_text: str) -> str:
+    """Project name for an email, keyed on its text, attachments and the extracted corpus."""
+    import utils
+    return utils.extract_project_name_from_content(email_text, attachments_data, all_text)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_project_search(project_name: str) -> dict:
+    """Monday.com similarity search for a project name."""
+    return get_monday_interface().check_project_exists(project_name)
+
+
+def _match_subject_project(email_text: str) -> None:
+    """Take the project name from the Subject line when Monday.com has a near-exact match for it."""
+    m = _SUBJECT_NAME.search(email_text)
+    name = m.group("name").strip() if m else ""
+    if not name:
+        return
+    results = cached_project_search(name)
+    if results and results.get("exists") and results.get("similarity_score", 0.0) > SUBJECT_MATCH_MIN_SIMILARITY:
+        st.session_state.project_name = name
+        st.session_state.search_results = results
+
 
 # ---------------------------------------------------------------------------
 # CHAT PANEL 
@@ -42,6 +112,7 @@ monday_interface     = MondayDotComInterface(MONDAY_API_TOKEN) if MONDAY_API_TOK
 
 def show_chat() -> None:
     """Assistant copilot for the parameters."""
+    import utils
     st.session_state.setdefault("chat_history", [])
     st.session_state.setdefault("extracted_params_dict", None)
 
@@ -68,80 +139,239 @@ def show_chat() -> None:
                 st.markdown("Raw extracted text:")
                 st.text_area("Raw", st.session_state.get("all_extracted_text", "<none>"), height=300)
             st.session_state["chat_history"].append({"role": "assistant", "content": "📄 Raw text displayed."})
-            st.rerun()
+            return
 
-        # build system context
-        params_text = "\n".join(f"• **{k}**: {v}" for k, v in st.session_state["extracted_params_dict"].items())
+        # build the system context once per parameter set. The extracted text is
+        # already in the corpus context cache shared with the parameter query, so
+        # each turn only sends the parameters and the new question
+        params = st.session_state["extracted_params_dict"]
         raw_text = st.session_state.get("all_extracted_text", "")
-        system = (
-            "You are a roofing‑design assistant. Use the parameters below when answering; "
-            "ask clarifying questions only when necessary.\n\n" + params_text + 
-            "\n\nRaw extracted text from documents:\n" + raw_text
-        )
-        with st.spinner("Thinking …"):
-            resp = gemini_api_with_retry("gemini-2.5-flash-preview-04-17", [system, prompt])
+        context_fp = hash((tuple(params.items()), raw_text))
+        if st.session_state.get("chat_context_fp") != context_fp:
+            params_text = "\n".join(f"• **{k}**: {v}" for k, v in params.items())
+            st.session_state["chat_system"] = (
+                "You are a roofing‑design assistant. Use the parameters below when answering; "
+                "ask clarifying questions only when necessary.\n\n" + params_text
+            )
+            st.session_state["chat_corpus"] = utils.dedupe_repeated_blocks(raw_text)
+            st.session_state["chat_context_fp"] = context_fp
 
+        # looked up every turn: the cache is recreated once it has expired server-side
+        corpus = st.session_state["chat_corpus"]
+        cache_name = utils.corpus_context_cache(corpus) if corpus else None
+        system = st.session_state["chat_system"]
+        if not cache_name:
+            system += "\n\nRaw extracted text from documents:\n" + raw_text
+        parts = [system, prompt]
+
+        # stream the reply straight into the chat bubble – no spinner, no rerun
         with st.chat_message("assistant"):
-            st.markdown(resp.text)
-        st.session_state["chat_history"].append({"role": "assistant", "content": resp.text})
-        st.rerun()
+            answer = st.write_stream(utils.stream_cached_llm(CHAT_MODEL, parts, cached_content=cache_name))
+        st.session_state["chat_history"].append({"role": "assistant", "content": answer})
 
 # ---------------------------------------------------------------------------
 # EXTRACT PIPELINE (left column helpers)
 # ---------------------------------------------------------------------------
 
-def process_uploaded_files(uploaded_files) -> str:
-    """Run through every uploaded file and return concatenated extracted text."""
-    all_text = ""
-    for f in uploaded_files:
-        suffix = f".{f.name.split('.')[-1]}"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(f.getvalue())
-            path = tmp.name
+def _process_one(item, ctx) -> tuple[str, dict | None]:
+    """Extract text from one uploaded email (runs in a worker thread).
+
+    Returns the text chunk for this file plus the email data (or None) so the
+    caller can update session state from the script thread.
+    """
+    import utils
+    # attach the Streamlit run context so st.spinner / st.error still work here
+    add_script_run_ctx(threading.current_thread(), ctx)
+    kind, name, data = item
+    if kind in ("eml", "msg"):
+        header, body, att, inline = data
+        label = "EMAIL FILE" if kind == "eml" else "OUTLOOK EMAIL FILE"
+        email_text = header + "\n" + body
         try:
-            if f.name.lower().endswith(".eml"):
-                header, body, att, inline = process_eml_file(path)
-                email_text = header + "\n" + body
-                if st.session_state.email_data is None:
-                    st.session_state.email_data = {"email_text": email_text, "attachments_data": att}
-                extracted = extract_text_from_email(email_text, att, inline)
-                all_text += f"\n\nEMAIL FILE: {f.name}\n{extracted}\n{'='*50}\n"
-            elif f.name.lower().endswith(".msg"):
-                header, body, att, inline = process_msg_file(path)
-                email_text = header + "\n" + body
-                if st.session_state.email_data is None:
-                    st.session_state.email_data = {"email_text": email_text, "attachments_data": att}
-                extracted = extract_text_from_email(email_text, att, inline)
-                all_text += f"\n\nOUTLOOK EMAIL FILE: {f.name}\n{extracted}\n{'='*50}\n"
-            elif f.name.lower().endswith(".pdf"):
-                pdf_text = process_pdf_with_gemini(f.getvalue(), f.name)
-                all_text += f"\n\nPDF FILE: {f.name}\n{pdf_text}\n{'='*50}\n"
+            extracted = utils.extract_text_from_email(email_text, att, inline)
         finally:
-            os.remove(path)
+            utils.cleanup_attachment_files(att)   # spooled PDF attachments are no longer needed
+        chunk = f"\n\n{label}: {name}\n{extracted}\n{FILE_SEPARATOR}"
+        # the spooled files are gone, so their entries (which only hold a 'path') aren't handed on
+        att = [a for a in att if "path" not in a]
+        return chunk, {"email_text": email_text, "attachments_data": att}
+    return "", None
+
+
+def _process_pdfs(pdf_items, email_corpus, ctx) -> list[tuple[str, None]]:
+    """Extract the uploaded PDFs together, one Gemini call when they fit inline (runs in a worker thread)."""
+    import utils
+    add_script_run_ctx(threading.current_thread(), ctx)
+    pdf_texts = utils.extract_pdfs_smart([{"filename": name, "content": data} for _, name, data in pdf_items], email_corpus)
+    chunks = []
+    for (_, name, _), pdf_text in zip(pdf_items, pdf_texts):
+        if pdf_text is None:
+            chunks.append((f"\n\nPDF FILE (skipped: covered by email): {name}\n", None))
+        else:
+            chunks.append((f"\n\nPDF FILE: {name}\n{pdf_text}\n{FILE_SEPARATOR}", None))
+    return chunks
+
+
+def process_uploaded_files(uploaded_files) -> str:
+    """Run through every uploaded file concurrently and return concatenated extracted text."""
+    files = tuple((f.name, f.getvalue()) for f in uploaded_files)
+    all_text, email_data = _extract_uploads(files)
+
+    # session state is only touched from the script thread
+    if email_data and st.session_state.email_data is None:
+        st.session_state.email_data = email_data
     return all_text
 
 
+def _extract_uploads(files: tuple[tuple[str, bytes], ...]) -> tuple[str, dict | None]:
+    """Extracted text and first email's data for (name, bytes) uploads.
+
+    Not cached as a whole: re-processing the same files is already cheap because
+    PDF and image results are cached per content hash, and a failed extraction
+    is then retried rather than replayed.
+    """
+    import utils
+    # every parser accepts raw bytes, so uploads are handed over without a disk round-trip.
+    # Emails are parsed up front (local and cheap) so PDFs that merely repeat an
+    # email body can skip their Gemini call.
+    # Several emails are parsed concurrently, since parsing spools their PDF attachments to disk.
+    parsers = {"eml": utils.process_eml_bytes, "msg": utils.process_msg_bytes}
+
+    def parse(upload):
+        name, data = upload
+        kind = name.split('.')[-1].lower()
+        parser = parsers.get(kind)
+        return kind, name, parser(data) if parser else data
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_FILE_WORKERS, len(files)))) as executor:
+        items = list(executor.map(parse, files))
+    email_corpus = "\n".join(data[0] + "\n" + data[1] for kind, _, data in items if kind in ("eml", "msg"))
+
+    results = [("", None)] * len(items)
+    # live per-file table: each row fills in as soon as that file's extraction returns
+    progress = st.empty()
+    rows = [{"File": name, "Status": "processing…", "Characters": None, "Preview": ""} for _, name, _ in items]
+    progress.dataframe(rows, hide_index=True, use_container_width=True)
+
+    ctx = get_script_run_ctx()
+    pdf_indices = [i for i, item in enumerate(items) if item[0] == "pdf"]
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_FILE_WORKERS, len(items)))) as executor:
+        # future -> indices of the uploads it covers; the standalone PDFs share one task
+        futures = {executor.submit(_process_one, item, ctx): [i]
+                   for i, item in enumerate(items) if item[0] != "pdf"}
+        if pdf_indices:
+            futures[executor.submit(_process_pdfs, [items[i] for i in pdf_indices], email_corpus, ctx)] = pdf_indices
+        for future in as_completed(futures):
+            result = future.result()
+            for i, res in zip(futures[future], result if isinstance(result, list) else [result]):
+                results[i] = res
+                chunk = res[0]
+                rows[i].update(Status="done", Characters=len(chunk), Preview=" ".join(chunk.split())[:120])
+            progress.dataframe(rows, hide_index=True, use_container_width=True)
+
+    email_data = next((data for _, data in results if data), None)
+    return "".join(chunk for chunk, _ in results), email_data
+
+
+# ---------------------------------------------------------------------------
+# LLM RESPONSE PARSING
+# ---------------------------------------------------------------------------
+
+def parse_llm_params(resp: str) -> dict:
+    """Raw parameter values from the LLM response (JSON mode; prose regex as fallback)."""
+    try:
+        data = json.loads(resp)
+        if isinstance(data, dict):
+            return {p: str(data[p]).strip() for p in PARAM_NAMES if data.get(p) not in (None, "")}
+    except json.JSONDecodeError:
+        pass
+
+    # one scan over the response; the first mention of each parameter wins
+    if _PARAM_DB is not None:
+        return _scan_params_hyperscan(resp)
+    found = {}
+    for m in PARAM_PATTERN.finditer(resp):
+        found.setdefault(_PARAM_CANON[m.group("key").lower()], m.group("val").strip())
+    return found
+
+
+def _clean_param_value(param: str, val: str) -> str:
+    """Special processing for specific parameters (Tapered Insulation category, Post Code area)."""
+    import utils
+    if param == "Tapered Insulation":
+        return utils.map_tapered_insulation_value(val)
+    if param != "Post Code":
+        return val
+
+    # For Post Code, extract just the postcode area (initial letters).
+    # First clean up any formatting from the LLM response
+    cleaned_value = _POSTCODE_CLEAN.sub('', val).strip()
+    # Check if the value indicates "not provided" or similar
+    if _NOT_PROVIDED.search(cleaned_value):
+        return "Not provided"
+    # Match the UK postcode area; keep the original value if it doesn't match a postcode pattern
+    postcode_match = _UK_POSTCODE.search(cleaned_value.upper())
+    return postcode_match.group(1) if postcode_match else cleaned_value
+
+
+def _scan_params_hyperscan(resp: str) -> dict:
+    """Hyperscan variant of the fallback scan: earliest key offset per parameter, value read from there."""
+    buf = resp.encode("utf-8")
+    first_end = {}
+
+    def on_match(idx, start, end, flags, context):
+        if idx not in first_end or start < first_end[idx][0]:
+            first_end[idx] = (start, end)
+
+    _PARAM_DB.scan(buf, match_event_handler=on_match)
+
+    found = {}
+    for idx, (_, end) in sorted(first_end.items(), key=lambda kv: kv[1][0]):
+        m = _PARAM_VALUE.match(buf, end)
+        found[PARAM_NAMES[idx]] = m.group(1).decode("utf-8", "replace").strip()
+    return found
+
+
 # ---------------------------------------------------------------------------
 # RESULTS DISPLAY + DOWNLOAD
 # ---------------------------------------------------------------------------
 
-def present_results(df: pd.DataFrame, extra_llm_response: str | None = None) -> None:
-    """Show DF, create download, cache to session for chat."""
-    st.subheader("Extracted Parameters")
-    st.dataframe(df, use_container_width=True)
+@st.cache_data(show_spinner=False)
+def _build_xlsx(params: dict, extra_llm_response: str | None = None) -> bytes:
+    """Serialise the parameters (and optional full response) to XLSX bytes; cached per input."""
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    def cell(value) -> str:
+        # control characters XML can't hold are dropped; Excel caps the text in one cell
+        return ILLEGAL_CHARACTERS_RE.sub("", str(value))[:XLSX_CELL_MAX_CHARS]
+
+    # write-only workbooks stream rows out instead of holding a cell grid in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Parameters")
+    ws.append([cell(k) for k in params.keys()])
+    ws.append([cell(v) for v in params.values()])
+    if extra_llm_response:
+        ws2 = wb.create_sheet("Full Response")
+        ws2.append(["Response"])
+        ws2.append([cell(extra_llm_response)])
 
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="Parameters")
-        if extra_llm_response:
-            pd.DataFrame({"Response": [extra_llm_response]}).to_excel(writer, index=False, sheet_name="Full Response")
-    buffer.seek(0)
+    wb.save(buffer)
+    return buffer.getvalue()
 
-    st.download_button("Download as Excel", buffer, "Technical_Parameters.xlsx", mime="application/vnd.ms-excel")
+
+def present_results(params: dict, extra_llm_response: str | None = None) -> None:
+    """Show the parameters, create download, cache to session for chat."""
+    st.subheader("Extracted Parameters")
+    st.dataframe([params], use_container_width=True)
+
+    # workbook is only rebuilt when the results change, not on every rerun
+    st.download_button("Download as Excel", _build_xlsx(params, extra_llm_response),
+                       "Technical_Parameters.xlsx", mime="application/vnd.ms-excel")
 
     # cache for chat
-    st.session_state["extracted_params_df"]   = df
-    st.session_state["extracted_params_dict"] = df.iloc[0].to_dict()
+    st.session_state["extracted_params_dict"] = params
 
 # ---------------------------------------------------------------------------
 # MAIN APP (UI orchestration)
@@ -171,6 +401,10 @@ def main():
         button_col1, button_col2, button_col3 = st.columns([2, 2, 2])
         with button_col2:
             process_clicked = st.button("▶️ Process Files", use_container_width=True)
+
+        # upload UI is on screen – now pull in the heavy helpers (google-genai via utils)
+        import utils
+        monday_interface = get_monday_interface()
         
         # Init session keys
         for k, default in {
@@ -198,10 +432,17 @@ def main():
                 # Extract project name if not already done
                 if not st.session_state.project_name:
                     with st.spinner("Extracting project name from email..."):
-                        st.session_state.project_name = extract_project_name_from_content(
-                            st.session_state.email_data['email_text'], 
-                            st.session_state.email_data['attachments_data']
-                        )
+                        # A subject line that closely matches a Monday.com project needs no Gemini call
+                        _match_subject_project(st.session_state.email_data['email_text'])
+                        
+                        # Only the project name is needed here: an existing project's parameters come
+                        # from Monday.com, so the full parameter query waits until this is a new enquiry
+                        if not st.session_state.project_name:
+                            st.session_state.project_name = cached_project_name(
+                                st.session_state.email_data['email_text'], 
+                                st.session_state.email_data['attachments_data'],
+                                st.session_state.get("all_extracted_text") or ""
+                            )
                 
                 st.subheader("Email Analysis")
                 st.write(f"Extracted Project Name: **{st.session_state.project_name}**")
@@ -209,7 +450,7 @@ def main():
                 # Search for similar projects if not already done
                 if not st.session_state.search_results and st.session_state.project_name:
                     with st.spinner("Searching for similar projects in Monday.com..."):
-                        st.session_state.search_results = monday_interface.check_project_exists(st.session_state.project_name)
+                        st.session_state.search_results = cached_project_search(st.session_state.project_name)
                 
                 # Display project matches if any
                 if st.session_state.search_results and st.session_state.search_results['exists'] and st.session_state.search_results['matches']:
@@ -284,13 +525,27 @@ def main():
         if not st.session_state.processing_complete:
             st.info("Upload and process files to see analysis results here.")
         else:
-            results_data = []
+            # Results only depend on the enquiry type, the Monday.com project and the
+            # extracted text, so chat messages and other widget reruns reuse them
+            # instead of re-parsing the project or re-querying Gemini
+            fingerprint = hashlib.sha256((
+                st.session_state.enquiry_type
+                + repr(st.session_state.get("project_details"))
+                + (st.session_state.get("all_extracted_text") or "")
+            ).encode()).hexdigest()
+            fresh = st.session_state.get("results_fp") == fingerprint
+
             if st.session_state.enquiry_type == "Amendment" and st.session_state.get("project_details"):
-                with st.spinner("Extracting parameters from Monday.com project …"):
-                    # Parse the project details to extract parameters
-                    print("DEBUG: Extracting parameters from project details")
-                    params = extract_parameters_from_monday_project(st.session_state.project_details)
-                    print("DEBUG: Extracted params: ", params)
+                if fresh:
+                    params = st.session_state["results_df"]
+                else:
+                    with st.spinner("Extracting parameters from Monday.com project …"):
+                        # Parse the project details to extract parameters
+                        print("DEBUG: Extracting parameters from project details")
+                        params = utils.extract_parameters_from_monday_project(st.session_state.project_details)
+                        print("DEBUG: Extracted params: ", params)
+                    st.session_state["results_fp"]   = fingerprint
+                    st.session_state["results_df"]   = params
 
                 # Display the extracted parameters
                 st.write("The following parameters were extracted from Monday.com:")
@@ -298,65 +553,39 @@ def main():
                     if value and value != "Not found":
                         st.write(f"**{key}:** {value}")
 
-                df = pd.DataFrame([params])
-                present_results(df)
+                present_results(params)
             else:
                 # New Enquiry – use Gemini to parse `all_extracted_text`
                 if hasattr(st.session_state, 'all_extracted_text') and st.session_state.all_extracted_text:
-                    # Update the query to include the determined enquiry type
-                    query = DEFAULT_QUERY
-                    if hasattr(st.session_state, 'enquiry_type') and st.session_state.enquiry_type:
-                        # Make sure the query contains instructions to find the Reason for Change
-                        if "Reason for Change" in query:
-                            # Update the query to specify the determined enquiry type
-                            query = query.replace("Reason for Change: (Either 'Amendment' or 'New Enquiry' depending on the context of the email)", 
-                                                f"Reason for Change: ({st.session_state.enquiry_type})")
-                    
-                    # with st.spinner("Analysing Extracted Data …"):
-                    resp = query_llm(st.session_state.all_extracted_text, query)
-                    
+                    if fresh:
+                        resp   = st.session_state["results_resp"]
+                        df_row = st.session_state["results_df"]
+                    else:
+                        # Use the query with "Reason for Change" pinned to the determined enquiry type
+                        query = _QUERY_VARIANTS.get(st.session_state.get("enquiry_type"), DEFAULT_QUERY)
+
+                        # with st.spinner("Analysing Extracted Data …"):
+                        resp = utils.query_llm(st.session_state.all_extracted_text, query)
+
+                        found = parse_llm_params(resp)
+
+                        # Remove leading asterisks from all values, then apply per-parameter cleanup
+                        df_row = {p: _clean_param_value(p, _LEADING_STARS.sub('', found.get(p, "Not found")))
+                                  for p in PARAM_NAMES}
+
+                        st.session_state["results_fp"]   = fingerprint
+                        st.session_state["results_resp"] = resp
+                        st.session_state["results_df"]   = df_row
+                        st.session_state["results_md"]   = "\n".join(f"- **{k}:** {v}" for k, v in found.items())
+
                     # Display LLM response
                     st.subheader("AI Analysis Results")
-                    st.markdown(resp)
-                    
-                    df_row = {}
-                    for p in [
-                        "Post Code","Drawing Reference","Drawing Title","Revision","Date Received","Company","Contact","Reason for Change","Surveyor","Target U-Value","Target Min U-Value","Fall of Tapered","Tapered Insulation","Decking"]:
-                        m = re.search(rf"{p}:?\s*(.*?)(?:\n|$)", resp, re.I)
-                        val = m.group(1).strip() if m else "Not found"
-                        
-                        # Remove leading asterisks from all values
-                        val = re.sub(r'^\*+\s*', '', val)
-                        
-                        # Special processing for specific parameters
-                        if p == "Tapered Insulation":
-                            val = map_tapered_insulation_value(val)
-                        # For Post Code, extract just the postcode area (initial letters)
-                        elif p == "Post Code":
-                            # First clean up any formatting from the LLM response
-                            cleaned_value = re.sub(r'^\s*of Project Location:?\*?\s*', '', val, flags=re.IGNORECASE)
-                            cleaned_value = cleaned_value.strip()
-                            
-                            # Check if the value indicates "not provided" or similar
-                            if re.search(r'not\s+provided|not\s+found|none', cleaned_value, re.IGNORECASE):
-                                val = "Not provided"
-                            else:
-                                # Define UK postcode pattern
-                                uk_postcode_pattern = r'([A-Z]{1,2})[0-9]'
-                                postcode_match = re.search(uk_postcode_pattern, cleaned_value.upper())
-                                if postcode_match:
-                                    val = postcode_match.group(1)
-                                else:
-                                    # Keep original value if it doesn't match a postcode pattern
-                                    val = cleaned_value
-                        
-                        df_row[p] = val
+                    st.markdown(st.session_state["results_md"])
 
-                    df = pd.DataFrame([df_row])
-                    present_results(df, resp)
+                    present_results(df_row, resp)
 
             # Reset button
-            st.button("Process New Files", on_click=reset_app_state, use_container_width=True)
+            st.button("Process New Files", on_click=utils.reset_app_state, use_container_width=True)
 
         # Move chat section OUTSIDE the if block so it's always visible
         # Add visual divider before chat section
@@ -374,7 +603,7 @@ def main():
         st.markdown("<hr style='margin: 15px 0;'>", unsafe_allow_html=True)
         reset_col1, reset_col2, reset_col3 = st.columns([2, 2, 2])
         with reset_col2:
-            reset_button = st.button("🔄 Reset App", help="Reset app", on_click=reset_app_state, use_container_width=True)
+            reset_button = st.button("🔄 Reset App", help="Reset app", on_click=utils.reset_app_state, use_container_width=True)
 
 # ---------------------------------------------------------------------------
 # bootstrap
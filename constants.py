@@ -1,3 +1,16 @@
+# Gemini model used for every extraction, analysis and chat call
+GEMINI_MODEL = "gemini-2.5-flash-preview-04-17"
+
+# Line closing each uploaded file's section of the extracted text; long texts are split after it
+FILE_SEPARATOR = "=" * 50 + "\n"
+
+# Prompts sent alongside a single PDF / image
+PDF_EXTRACT_PROMPT = "Please extract all text content from this PDF document, including text from tables, diagrams, and charts."
+IMAGE_DESCRIBE_PROMPT = "Describe this image in detail, including any visible text, diagrams, or drawings. Extract any technical parameters or specifications you can see."
+
+# Replaced by the enquiry type once it has been determined from Monday.com
+REASON_FOR_CHANGE_INSTRUCTION = "Reason for Change: (Either 'Amendment' or 'New Enquiry' based on whether the request refers to an existing project or is entirely new)"
+
 DEFAULT_QUERY = """Extract the following design parameters from the documents for a TaperedPlus technical drawing request: 
             - Post Code of Project Location: (Mostly found in the title block of the drawing attached to emails. Ignore the postcode of any company office address or sender/recipient address and use the post code of the project location only, otherwise state 'Not provided').
             - Drawing Reference: (TaperedPlus Reference Number e.g. TP*****_**.** - *. Look for references associated with TaperedPlus specifically. If multiple exist, prioritize the latest one mentioned in the context of the request *to* TaperedPlus).
@@ -12,4 +25,22 @@ DEFAULT_QUERY = """Extract the following design parameters from the documents fo
             - Target Min U-Value: (A secondary or minimum target U-Value if specified, often for specific areas like upstands).
             - Fall of Tapered: (The required fall or slope for the tapered insulation).
             - Tapered Insulation: (The type or brand of tapered insulation product requested).
-            - Decking: (The type of roof decking material described)."""
\ No newline at end of file
+            - Decking: (The type of roof decking material described)."""
+
+# Parameters extracted for every enquiry, in output column order
+PARAM_NAMES = (
+    "Post Code",
+    "Drawing Reference",
+    "Drawing Title",
+    "Revision",
+    "Date Received",
+    "Company",
+    "Contact",
+    "Reason for Change",
+    "Surveyor",
+    "Target U-Value",
+    "Target Min U-Value",
+    "Fall of Tapered",
+    "Tapered Insulation",
+    "Decking",
+)
@@ -552,19 +552,25 @@ class MondayDotComInterface:
             result['error'] = "No projects found to compare against"
             return result
         
-        # Helper function for string similarity using Levenshtein distance
+        # Helper function for string similarity using Levenshtein distance.
+        # Scores below similarity_threshold are never reported, so a pair is
+        # abandoned (scored 0.0) as soon as its distance is bound to exceed
+        # the largest distance that would still reach the threshold.
         def similarity(s1: str, s2: str) -> float:
-            """Calculate string similarity between 0.0 and 1.0"""
+            """Calculate string similarity between 0.0 and 1.0 (0.0 below similarity_threshold)"""
             if not s1 or not s2:
                 return 0.0
             
-            # Convert both strings to lowercase for case-insensitive comparison
-            s1, s2 = s1.lower(), s2.lower()
-            
             # Calculate Levenshtein distance
             if len(s1) < len(s2):
                 s1, s2 = s2, s1
             
+            max_len = len(s1)
+            max_distance = (1 - similarity_threshold) * max_len + 1e-9
+            # The distance is at least the difference in length
+            if max_len - len(s2) > max_distance:
+                return 0.0
+            
             distances = range(len(s2) + 1)
             for i, c1 in enumerate(s1):
                 distances_ = [i + 1]
@@ -574,14 +580,16 @@ class MondayDotComInterface:
                     else:
                         distances_.append(1 + min((distances[j], distances[j + 1], distances_[-1])))
                 distances = distances_
+                # A row's minimum never decreases further down the table
+                if min(distances) > max_distance:
+                    return 0.0
             
             # Calculate similarity as 1 - normalized_distance
-            max_len = max(len(s1), len(s2))
-            if max_len == 0:
-                return 1.0  # Both strings are empty
-            
             return 1 - (distances[-1] / max_len)
         
+        # Convert the sample to lowercase once for case-insensitive comparison
+        sample_lower = sample_project_name.lower() if sample_project_name else ""
+        
         # Helper function to extract project title from column values
         def extract_project_title(column_values):
             project_title = None
@@ -610,7 +618,7 @@ class MondayDotComInterface:
                 project_title = project_name
             
             # Calculate similarity score
-            sim_score = similarity(sample_project_name, project_title)
+            sim_score = similarity(sample_lower, project_title.lower())
             
             if sim_score >= similarity_threshold:
                 matches.append({
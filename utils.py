@@ -1,54 +1,222 @@
 import os
+import io
+import binascii
 import time
-import random
-from email.parser import BytesParser
+import json
+import re
+import html
+import hashlib
+import zlib
+import threading
+import sqlite3
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from contextlib import contextmanager, ExitStack
+from email.parser import BytesFeedParser
 from email import policy
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import tempfile  
-import extract_msg  
+import pypdfium2 as pdfium
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential, wait_random
 
 
 # Update imports to use the newer client approach
 from google import genai
 from google.genai import types
-from monday_dot_com_interface import MondayDotComInterface
+from google.genai import errors as genai_errors
+from constants import PARAM_NAMES, GEMINI_MODEL, PDF_EXTRACT_PROMPT, IMAGE_DESCRIBE_PROMPT, FILE_SEPARATOR
 from dotenv import load_dotenv
 
-# Initialize Monday.com client
 load_dotenv()
-monday_api_token = os.environ.get("MONDAY_API_TOKEN")
-monday_interface = MondayDotComInterface(monday_api_token) if monday_api_token else None
 
-# Initialize the client
+# Initialize the client; the bound method skips the attribute lookups on every call
 client = genai.Client(api_key=os.environ.get("GOOGLE_API_KEY"))
+_generate = client.models.generate_content
 
+# Local PDF text is trusted when it reaches this fraction of a "full" page of text
+PDF_EXPECTED_CHARS_PER_PAGE = 1000
+PDF_TEXT_CONFIDENCE_THRESHOLD = 0.8
+PDF_LOCAL_MIN_CHARS = 200
+# PDFium is not thread-safe, so all pdfium work (open, read, close) is serialised across threads and sessions
+_pdfium_lock = threading.Lock()
+
+# A PDF whose text is mostly already in the uploaded emails is not sent to Gemini
+PDF_COVERED_RATIO = 0.8
+PDF_MIN_TEXT_CHARS = 50
+
+# Deterministic (temperature 0) responses are reused for this long, up to LLM_CACHE_MAX_ENTRIES of them
+LLM_CACHE_TTL_SECONDS = 24 * 60 * 60
+LLM_CACHE_MAX_ENTRIES = 512
+_llm_cache = OrderedDict()   # key -> (stored at, text), oldest first; shared by all threads and sessions
+_llm_cache_lock = threading.Lock()
+
+# JSON shape requested from Gemini for the parameter extraction
+PARAMS_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={name: types.Schema(type=types.Type.STRING) for name in PARAM_NAMES},
+    required=list(PARAM_NAMES),
+    property_ordering=list(PARAM_NAMES),
+)
+
+# Header fields copied into the extracted email text, in order
+EMAIL_HEADER_FIELDS = ("From", "To", "Subject", "Date")
+
+# .eml files are fed to the email parser in chunks of this size; base64 PDF
+# attachments are decoded to disk in pieces of this many encoded characters
+EML_FEED_CHUNK_BYTES = 64 * 1024
+ATTACHMENT_DECODE_CHUNK_CHARS = 64 * 1024
+
+# HTML-only email bodies are reduced to text: drop scripts/styles, break lines at block tags, strip the rest
+_HTML_HIDDEN = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.S | re.I)
+_HTML_LINE_BREAK = re.compile(r"<br\s*/?>|</(?:p|div|tr|li|h[1-6])\s*>", re.I)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+# Gemini text extractions of PDFs (and image descriptions), persisted across sessions keyed by content hash + model
+PDF_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tdpe", "pdf_extractions.sqlite")
+PDF_CACHE_TTL_SECONDS = 30 * 24 * 3600   # rows older than this are ignored and pruned
+PDF_CACHE_MEMORY_ENTRIES = 256   # extractions kept in the in-process tier (least recently used dropped first)
+_pdf_cache_lock = threading.Lock()
+_pdf_memory_cache = OrderedDict()   # in-process tier in front of the sqlite file: (hash, model) -> (created, text)
+_pdf_memory_lock = threading.Lock()
+
+# Instruction used by extract_project_name_from_content
+PROJECT_NAME_QUERY = (
+    "Based on the email content and attachments, extract the project name (drawing title) which is usually the project location.\n"
+    "    Return only the project name, nothing else."
+)
+
+# query_llm splits extracted text longer than this (roughly 100k tokens) at file boundaries
+QUERY_CHUNK_CHARS = 400_000
+# Extracted text shared by the project-name and parameter queries goes into a Gemini context cache
+CORPUS_CACHE_PREAMBLE = "Please analyze the following information extracted from emails, PDF documents, and images:\n\n"
+CORPUS_CACHE_TTL_SECONDS = 3600
+# A cache this close to expiring is replaced rather than reused, so it can't lapse mid-request
+CORPUS_CACHE_REFRESH_MARGIN_SECONDS = 300
+MISSING_VALUES = ("not found", "not provided", "none", "n/a")
+
+# Repeated boilerplate is collapsed before analysis (see dedupe_repeated_blocks);
+# blocks average DEDUP_BLOCK_DIVISOR lines
+DEDUP_BLOCK_DIVISOR = 8
+DEDUP_MIN_BLOCK_CHARS = 200
+
+
+# PDFs up to this size are sent inline with the prompt; larger ones go through the File API,
+# uploaded once per content hash and referenced for PDF_UPLOAD_TTL_SECONDS
+PDF_INLINE_LIMIT_BYTES = 8 * 1024 * 1024
+PDF_UPLOAD_TTL_SECONDS = 60 * 60
+_uploaded_pdfs = {}   # digest -> (upload time, File API handle, ids of the sessions using it)
+_uploaded_pdfs_lock = threading.Lock()
+
+# One lock per PDF hash, so the same PDF arriving in several emails at once is sent to Gemini once
+_pdf_digest_locks = {}   # digest -> [lock, threads holding or waiting]; dropped when unused
+_pdf_digest_locks_lock = threading.Lock()
+
+# Marks the start of each PDF's text in a batched multi-PDF response
+PDF_BATCH_SEPARATOR = re.compile(r"^\s*===\s*PDF\s+(\d+)\s*===\s*$", re.M)
+
+# Marks the start of each image's description in a batched multi-image response
+IMAGE_BATCH_SEPARATOR = re.compile(r"^\s*===\s*IMAGE\s+(\d+)\s*===\s*$", re.M)
+
+# Attachments treated as images, and the image formats Gemini is sent (with their MIME types)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+# Attachment extension -> how extract_text_from_email handles it (anything else is only noted)
+ATTACHMENT_KINDS = {'.pdf': 'pdf', **{ext: 'image' for ext in IMAGE_EXTENSIONS}}
+IMAGE_MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+
+# Attachments larger than this are not read out of a .msg file at all (large
+# drawings can stall extract_msg for minutes); they are only noted in the text
+MAX_ATTACHMENT_BYTES = 25 * 1024 * 1024
+# MAPI property PR_ATTACH_SIZE, readable without loading the attachment data
+PR_ATTACH_SIZE = '0E200003'
+
+# Limit on the visual items (PDFs + images) of one email that are processed, to avoid rate limits
+MAX_VISUAL_ITEMS = 10
+
+# Attachments of one email sent to Gemini at the same time
+MAX_ATTACHMENT_WORKERS = 4
+
+# Upper bound on Gemini requests in flight across all worker threads; uploads
+# and their attachments are fanned out in nested pools, so this keeps the
+# total within the rate limit no matter how many files are processed at once
+GEMINI_CONCURRENCY = 8
+_gemini_slots = threading.BoundedSemaphore(GEMINI_CONCURRENCY)
+
+# Requests started per rolling minute across all threads; calls only wait
+# once the budget is used up, instead of sleeping before every request
+GEMINI_REQUESTS_PER_MINUTE = 60
+_gemini_request_times = deque()
+_gemini_request_times_lock = threading.Lock()
+
+def _wait_for_request_budget():
+    """Block until a request fits in the GEMINI_REQUESTS_PER_MINUTE window, then record it"""
+    while True:
+        with _gemini_request_times_lock:
+            now = time.monotonic()
+            while _gemini_request_times and now - _gemini_request_times[0] >= 60:
+                _gemini_request_times.popleft()
+            if len(_gemini_request_times) < GEMINI_REQUESTS_PER_MINUTE:
+                _gemini_request_times.append(now)
+                return
+            wait = 60 - (now - _gemini_request_times[0])
+        time.sleep(wait)
 
 
 # Define a function to check if an exception is a rate limit error
 def is_rate_limit_error(exception):
     return '429' in str(exception) or 'RESOURCE_EXHAUSTED' in str(exception)
 
+def _is_retryable(exception):
+    """Rate limits, Gemini server errors and network failures are worth retrying; anything else isn't"""
+    return is_rate_limit_error(exception) or isinstance(exception, (genai_errors.ServerError, httpx.TransportError))
 
-def gemini_api_with_retry(model, contents):
+
+# Retry policy shared by every Gemini call: up to five attempts with jittered
+# exponential backoff, for retryable errors only
+_retry_transient = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential(multiplier=1, min=2, max=60) + wait_random(0, 2),
+    stop=stop_after_attempt(5),
+    reraise=True,
+)
+
+
+@_retry_transient
+def gemini_api_with_retry(model, contents, config=None):
     """
     Call Gemini API with retry logic for rate limiting
     
+    Rate-limit, server and network errors are retried up to five times with
+    jittered exponential backoff; other errors (bad requests, bugs) are
+    raised straight away.
+    
     Args:
         model: The Gemini model to use
         contents: The contents to send to the model
+        config: Optional GenerateContentConfig for the request
         
     Returns:
         The model response
     """
     try:
-        # Add a small random delay to help with rate limiting
-        time.sleep(random.uniform(0.5, 1.5))
+        # Only waits when this minute's request budget is already spent
+        _wait_for_request_budget()
         
-        # Make the API call
-        response = client.models.generate_content(
-            model=model,
-            contents=contents
-        )
+        # Make the API call, waiting for a free slot if enough are already running
+        with _gemini_slots:
+            response = _generate(
+                model=model,
+                contents=contents,
+                config=config
+            )
         return response
     except Exception as e:
         # Check if this is a rate limiting error
@@ -56,14 +224,207 @@ def gemini_api_with_retry(model, contents):
             st.warning(f"Rate limit hit. Waiting before retrying... ({str(e)})")
             # Re-raise to trigger retry
             raise e
+        elif _is_retryable(e):
+            print(f"Transient Gemini error, retrying: {e}")
+            raise e
         else:
             # For other errors, log and re-raise without retry
             st.error(f"Error calling Gemini API: {str(e)}")
             raise e
 
+def _llm_cache_key(model, prompt_parts, response_schema=None, cached_content=None):
+    """SHA-256 of everything that shapes a response, used as the response cache key"""
+    schema = response_schema.model_dump_json(exclude_none=True) if response_schema else None
+    return hashlib.sha256(
+        json.dumps(
+            {"model": model, "parts": prompt_parts, "schema": schema, "cached_content": cached_content},
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()
+
+def _store_llm_response(key, text):
+    """Store a response in the cache, dropping the oldest entries once expired or over LLM_CACHE_MAX_ENTRIES"""
+    now = time.time()
+    with _llm_cache_lock:
+        _llm_cache[key] = (now, text)
+        _llm_cache.move_to_end(key)
+        # Entries are in storage order, so only the front needs checking
+        while _llm_cache:
+            oldest_ts = next(iter(_llm_cache.values()))[0]
+            if len(_llm_cache) <= LLM_CACHE_MAX_ENTRIES and now - oldest_ts < LLM_CACHE_TTL_SECONDS:
+                break
+            _llm_cache.popitem(last=False)
+
+def _cached_llm_response(key):
+    """Return the cached response text for key, or None if missing or expired"""
+    with _llm_cache_lock:
+        cached = _llm_cache.get(key)
+    if cached and time.time() - cached[0] < LLM_CACHE_TTL_SECONDS:
+        return cached[1]
+    return None
+
+def cached_llm(model, prompt_parts, temperature=0, response_schema=None, cached_content=None):
+    """
+    Call Gemini with text-only prompt parts, reusing earlier responses
+    
+    The cache key is the SHA-256 of the model, prompt parts and response
+    schema. Only deterministic calls (temperature 0) are cached; entries
+    expire after LLM_CACHE_TTL_SECONDS.
+    
+    Args:
+        model: The Gemini model to use
+        prompt_parts: A prompt string or a list of prompt strings
+        temperature: Sampling temperature for the request
+        response_schema: Optional types.Schema; the response is then JSON
+        cached_content: Optional Gemini context cache name holding the prompt prefix
+        
+    Returns:
+        str: The response text
+    """
+    if isinstance(prompt_parts, str):
+        prompt_parts = [prompt_parts]
+    config = types.GenerateContentConfig(
+        temperature=temperature,
+        response_mime_type="application/json" if response_schema else None,
+        response_schema=response_schema,
+        cached_content=cached_content,
+    )
+    
+    if temperature > 0:
+        return gemini_api_with_retry(model, prompt_parts, config).text
+    
+    key = _llm_cache_key(model, prompt_parts, response_schema, cached_content)
+    cached = _cached_llm_response(key)
+    if cached is not None:
+        return cached
+    
+    text = gemini_api_with_retry(model, prompt_parts, config).text
+    _store_llm_response(key, text)
+    return text
+
+@_retry_transient
+def _start_gemini_stream(model, contents, config):
+    """
+    Open a Gemini stream and read its first chunk
+    
+    Goes through the request budget and a _gemini_slots slot like
+    gemini_api_with_retry, and is retried the same way: nothing has been
+    yielded to the caller yet, so a failed attempt can simply be repeated.
+    Returns (first_chunk, stream) with the slot still held; the caller
+    releases it once the stream is finished.
+    """
+    _wait_for_request_budget()
+    _gemini_slots.acquire()
+    try:
+        stream = client.models.generate_content_stream(model=model, contents=contents, config=config)
+        return next(stream, None), stream
+    except Exception as e:
+        _gemini_slots.release()
+        if is_rate_limit_error(e):
+            st.warning(f"Rate limit hit. Waiting before retrying... ({str(e)})")
+        elif _is_retryable(e):
+            print(f"Transient Gemini error, retrying: {e}")
+        raise e
+
+def stream_cached_llm(model, prompt_parts, temperature=0, cached_content=None):
+    """
+    Streaming counterpart of cached_llm
+    
+    Yields response text chunks as Gemini produces them. A cached response
+    is yielded in one piece; a completed deterministic stream is cached.
+    Opening the stream is rate-limited and retried like gemini_api_with_retry;
+    once the first chunk has been yielded, errors are raised as they are.
+    cached_content is an optional Gemini context-cache name (see
+    create_context_cache) that is prepended to prompt_parts server-side.
+    """
+    if isinstance(prompt_parts, str):
+        prompt_parts = [prompt_parts]
+    config = types.GenerateContentConfig(temperature=temperature, cached_content=cached_content)
+    
+    key = _llm_cache_key(model, prompt_parts, cached_content=cached_content) if temperature == 0 else None
+    cached = _cached_llm_response(key) if key else None
+    if cached is not None:
+        yield cached
+        return
+    
+    try:
+        first, stream = _start_gemini_stream(model, prompt_parts, config)
+    except Exception as e:
+        st.error(f"Error calling Gemini API: {str(e)}")
+        raise e
+    
+    # the slot taken by _start_gemini_stream is held until the stream is drained
+    chunks = []
+    try:
+        for chunk in chain([first] if first is not None else [], stream):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+    except Exception as e:
+        st.error(f"Error calling Gemini API: {str(e)}")
+        raise e
+    finally:
+        _gemini_slots.release()
+    
+    if key:
+        _store_llm_response(key, "".join(chunks))
+
+def create_context_cache(model, text, ttl="3600s"):
+    """
+    Store a large prompt prefix that is re-sent on every call as Gemini
+    cached content, so later calls only pay for the new tokens.
+    
+    Returns:
+        str: The cache name, or None when the content can't be cached
+             (e.g. it is below the model's minimum cacheable size)
+    """
+    try:
+        cache = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(contents=[text], ttl=ttl)
+        )
+        return cache.name
+    except Exception as e:
+        print(f"Context caching unavailable, sending the prompt inline: {e}")
+        return None
+
+def corpus_context_cache(text):
+    """
+    Gemini context cache holding the extracted text, created once per corpus
+    
+    The project-name and parameter queries both run over the same text, so
+    it is cached once and each query only sends its question. Cache names
+    and their expiry times are kept in st.session_state["corpus_cache_names"]
+    (keyed by the text's SHA-256) so reset_app_state can delete them; a
+    cache that has expired (or is about to) server-side is created again.
+    
+    Returns:
+        str: The cache name, or None when the text can't be cached
+    """
+    names = st.session_state.setdefault("corpus_cache_names", {})
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    now = time.time()
+    entry = names.get(key)
+    if entry is None or now >= entry[0] - CORPUS_CACHE_REFRESH_MARGIN_SECONDS:
+        name = create_context_cache(GEMINI_MODEL, CORPUS_CACHE_PREAMBLE + text, ttl=f"{CORPUS_CACHE_TTL_SECONDS}s")
+        entry = names[key] = (now + CORPUS_CACHE_TTL_SECONDS, name)
+    return entry[1]
+
+def delete_session_context_caches():
+    """Delete the Gemini context caches created during this session (see corpus_context_cache)"""
+    for _, name in st.session_state.get("corpus_cache_names", {}).values():
+        if not name:
+            continue
+        try:
+            client.caches.delete(name=name)
+        except Exception as e:
+            print(f"Error deleting context cache {name}: {e}")
+
 # Add reset function
 def reset_app_state():
     """Clear all session state variables to reset the app"""
+    delete_session_uploads()
+    delete_session_context_caches()
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     return
@@ -81,25 +442,32 @@ def process_eml_file(eml_file_path):
       inline_images: list of dictionaries with inline image data.
     """
     # Open and parse the email file using the default email policy
+    parser = BytesFeedParser(policy=policy.default)
     with open(eml_file_path, 'rb') as f:
-        msg = BytesParser(policy=policy.default).parse(f)
+        while chunk := f.read(EML_FEED_CHUNK_BYTES):
+            parser.feed(chunk)
+    
+    return _extract_eml_message(parser.close())
+
+def process_eml_bytes(eml_data):
+    """
+    Same as process_eml_file, but parses the raw .eml bytes in memory
+    instead of reading them from disk.
+    """
+    # Feeding slices avoids the full-size decoded copy BytesParser.parsebytes makes
+    parser = BytesFeedParser(policy=policy.default)
+    view = memoryview(eml_data)
+    for start in range(0, len(view), EML_FEED_CHUNK_BYTES):
+        parser.feed(bytes(view[start:start + EML_FEED_CHUNK_BYTES]))
+    return _extract_eml_message(parser.close())
 
+def _extract_eml_message(msg):
+    """Pull header, body, attachments and inline images out of a parsed email message"""
     # Extract header fields
-    header_info = (
-        f"From: {msg.get('from', '')}\n"
-        f"To: {msg.get('to', '')}\n"
-        f"Subject: {msg.get('subject', '')}\n"
-        f"Date: {msg.get('date', '')}\n"
-    )
+    header_info = "".join(f"{label}: {msg.get(label.lower(), '')}\n" for label in EMAIL_HEADER_FIELDS)
     
-    # Extract the email body
-    body = ""
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == "text/plain" and not part.get_filename():
-                body += part.get_content() + "\n"
-    else:
-        body = msg.get_content()
+    # Extract the email body, including forwarded messages and extra inline text parts
+    body = _email_body_text(msg)
     
     # Process attachments and inline images
     attachments_data = []
@@ -113,7 +481,7 @@ def process_eml_file(eml_file_path):
             content_id = part.get('Content-ID')
             
             # Images with Content-ID are typically inline
-            if content_id and filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp')):
+            if content_id and filename.lower().endswith(IMAGE_EXTENSIONS):
                 is_inline = True
                 
             if is_inline:
@@ -125,104 +493,593 @@ def process_eml_file(eml_file_path):
                 }
                 inline_images.append(inline_image_data)
             else:
-                attachment_data = {
-                    'filename': filename,
-                    'content': part.get_payload(decode=True)
-                }
-                attachments_data.append(attachment_data)
+                attachments_data.append(_attachment_entry(filename, part))
     
     return header_info, body, attachments_data, inline_images
 
-def process_pdf_with_gemini(pdf_content, filename):
-    """Process PDF content using Gemini's File API"""
+def _email_body_text(msg):
+    """
+    Body text of a parsed email: get_body's best part (plain, else HTML),
+    then any further inline text/plain parts, then the header and body of
+    each forwarded message (message/rfc822 part), recursively
+    """
+    texts = []
+    body_part = msg.get_body(preferencelist=('plain', 'html'))
+    if body_part:
+        text = body_part.get_content()
+        texts.append(_html_to_text(text) if body_part.get_content_type() == 'text/html' else text)
+    
+    for part in msg.iter_attachments():
+        if part.get_content_type() == 'text/plain' and not part.get_filename():
+            texts.append(part.get_content())
+        elif part.get_content_type() == 'message/rfc822':
+            forwarded = part.get_content()
+            header = "".join(f"{label}: {forwarded.get(label.lower(), '')}\n" for label in EMAIL_HEADER_FIELDS)
+            texts.append(f"FORWARDED MESSAGE:\n{header}\n{_email_body_text(forwarded)}")
+    return "\n".join(text for text in texts if text)
+
+def _html_to_text(html_body):
+    """Readable text of an HTML email body, so markup doesn't reach the prompt"""
+    text = _HTML_HIDDEN.sub("", html_body)
+    text = _HTML_LINE_BREAK.sub("\n", text)
+    text = html.unescape(_HTML_TAG.sub("", text))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+def _attachment_entry(filename, data):
+    """
+    Attachment dict for attachments_data
+    
+    data is the attachment's bytes, or its email.message part. PDFs (often
+    large drawings) are written straight to a temp file and referenced by
+    'path', so the decoded bytes aren't kept in memory for the rest of
+    processing; PDF handling uploads the file from there. Other attachments
+    keep their bytes under 'content'. Call cleanup_attachment_files once
+    the attachments have been processed.
+    """
+    if filename.lower().endswith(".pdf"):
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+            if isinstance(data, bytes):
+                temp_file.write(data)
+            else:
+                _write_decoded_payload(data, temp_file)
+            return {'filename': filename, 'path': temp_file.name}
+    if not isinstance(data, bytes):
+        data = data.get_payload(decode=True)
+    return {'filename': filename, 'content': data}
+
+def _write_decoded_payload(part, out):
+    """
+    Decode a base64 email part into out in ATTACHMENT_DECODE_CHUNK_CHARS
+    pieces, so the full decoded payload never exists as one bytes object;
+    other transfer encodings are decoded in one go
+    """
+    if part.get('Content-Transfer-Encoding', '').strip().lower() != 'base64':
+        out.write(part.get_payload(decode=True) or b"")
+        return
+    
+    # The payload string is read in slices in place (no full copy); each slice's
+    # whitespace is dropped and a remainder of under 4 characters carries over
+    payload = part.get_payload()
+    carry = ""
+    for start in range(0, len(payload), ATTACHMENT_DECODE_CHUNK_CHARS):
+        chunk = carry + "".join(payload[start:start + ATTACHMENT_DECODE_CHUNK_CHARS].split())
+        cut = len(chunk) - len(chunk) % 4
+        out.write(binascii.a2b_base64(chunk[:cut]))
+        carry = chunk[cut:]
+    if carry:
+        # Same padding tolerance as get_payload(decode=True)
+        out.write(binascii.a2b_base64(carry + "=" * (-len(carry) % 4)))
+
+def cleanup_attachment_files(attachments_data):
+    """Remove the temp files behind spooled attachments (see _attachment_entry)"""
+    for attachment in attachments_data:
+        path = attachment.get('path')
+        if path:
+            # One unlink; an already-removed file is fine
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+def _attachment_digest(item):
+    """SHA-256 of an attachment's bytes, whether held in memory or spooled to disk"""
+    if 'path' in item:
+        return _file_sha256(item['path'])
+    return hashlib.sha256(item['content']).hexdigest()
+
+def _pdf_cache_connect():
+    """Open the PDF extraction cache, creating the database and table on first use"""
+    os.makedirs(os.path.dirname(PDF_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(PDF_CACHE_PATH, timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cache "
+        "(hash TEXT, model TEXT, text TEXT, created REAL, PRIMARY KEY (hash, model))"
+    )
+    return conn
+
+def _pdf_memory_put(key, created, text):
+    """Add an extraction to the in-process tier, evicting the least recently used past PDF_CACHE_MEMORY_ENTRIES"""
+    with _pdf_memory_lock:
+        _pdf_memory_cache[key] = (created, text)
+        _pdf_memory_cache.move_to_end(key)
+        while len(_pdf_memory_cache) > PDF_CACHE_MEMORY_ENTRIES:
+            _pdf_memory_cache.popitem(last=False)
+
+def _pdf_cache_get(digest, model):
+    """Return the unexpired cached extraction for a PDF hash and model (memory first, then disk), or None"""
+    key = (digest, model)
+    cutoff = time.time() - PDF_CACHE_TTL_SECONDS
+    with _pdf_memory_lock:
+        entry = _pdf_memory_cache.get(key)
+        if entry is not None:
+            if entry[0] >= cutoff:
+                _pdf_memory_cache.move_to_end(key)
+                return entry[1]
+            del _pdf_memory_cache[key]
+    try:
+        with _pdf_cache_lock:
+            conn = _pdf_cache_connect()
+            try:
+                row = conn.execute(
+                    "SELECT created, text FROM cache WHERE hash=? AND model=? AND created >= ?",
+                    (digest, model, cutoff)
+                ).fetchone()
+            finally:
+                conn.close()
+    except sqlite3.Error as e:
+        print(f"PDF cache lookup failed: {e}")
+        return None
+    if row:
+        _pdf_memory_put(key, row[0], row[1])
+        return row[1]
+    return None
+
+@contextmanager
+def _pdf_digest_lock(digest):
+    """Lock held while a PDF is extracted; a concurrent extraction of the same bytes waits and reads the cache"""
+    with _pdf_digest_locks_lock:
+        entry = _pdf_digest_locks.setdefault(digest, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _pdf_digest_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _pdf_digest_locks[digest]
+
+@contextmanager
+def _pdf_digest_locks_held(digests):
+    """_pdf_digest_lock for several digests at once, taken in sorted order so two batches can't deadlock"""
+    with ExitStack() as stack:
+        for digest in sorted(digests):
+            stack.enter_context(_pdf_digest_lock(digest))
+        yield
+
+def _pdf_cache_put(digest, model, text):
+    """Store a successful extraction in the PDF cache, pruning rows older than PDF_CACHE_TTL_SECONDS"""
+    now = time.time()
+    _pdf_memory_put((digest, model), now, text)
     try:
-        # Create a temporary file to use with Gemini
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-            temp_file.write(pdf_content)
-            temp_file_path = temp_file.name
+        with _pdf_cache_lock:
+            conn = _pdf_cache_connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (hash, model, text, created) VALUES (?, ?, ?, ?)",
+                        (digest, model, text, now)
+                    )
+                    conn.execute("DELETE FROM cache WHERE created < ?", (now - PDF_CACHE_TTL_SECONDS,))
+            finally:
+                conn.close()
+    except sqlite3.Error as e:
+        print(f"PDF cache write failed: {e}")
+
+def _file_sha256(path):
+    """SHA-256 of a file on disk, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _uploaded_pdf(digest, pdf_file):
+    """
+    File API handle for a PDF, uploading it only when there is no live
+    upload of the same content (digest) yet
+    
+    Handles are kept for PDF_UPLOAD_TTL_SECONDS so a re-run or a second
+    prompt over the same drawing references the uploaded file instead of
+    sending it again; expired uploads are deleted from the File API. Handles
+    are shared by every session in the process, so each use is recorded
+    against the session (see delete_session_uploads).
+    """
+    now = time.time()
+    ctx = get_script_run_ctx()
+    session_id = ctx.session_id if ctx else None
+    with _uploaded_pdfs_lock:
+        expired = [d for d, (ts, _, _) in _uploaded_pdfs.items() if now - ts >= PDF_UPLOAD_TTL_SECONDS]
+        expired = [_uploaded_pdfs.pop(d)[1] for d in expired]
+        entry = _uploaded_pdfs.get(digest)
+        if entry:
+            entry[2].add(session_id)
+    
+    for stale in expired:
+        try:
+            client.files.delete(name=stale.name)
+        except Exception as e:
+            print(f"Could not delete uploaded file {stale.name}: {e}")
+    
+    # Remember which uploads this session used so reset_app_state can release them
+    st.session_state.setdefault("uploaded_pdf_digests", set()).add(digest)
+    if entry:
+        return entry[1]
+    uploaded = client.files.upload(file=pdf_file, config={"mime_type": "application/pdf"})
+    with _uploaded_pdfs_lock:
+        # Another session may have uploaded the same PDF meanwhile; the first handle is kept
+        entry = _uploaded_pdfs.setdefault(digest, (now, uploaded, set()))
+        entry[2].add(session_id)
+    return entry[1]
+
+def delete_session_uploads():
+    """
+    Release the File API uploads used by this session (see _uploaded_pdf)
+    
+    An upload is deleted once no other session is using it; otherwise it is
+    left for them (and removed when its TTL runs out).
+    """
+    ctx = get_script_run_ctx()
+    session_id = ctx.session_id if ctx else None
+    for digest in st.session_state.get("uploaded_pdf_digests", ()):
+        with _uploaded_pdfs_lock:
+            entry = _uploaded_pdfs.get(digest)
+            if entry:
+                entry[2].discard(session_id)
+                if entry[2]:
+                    continue
+                del _uploaded_pdfs[digest]
+        if entry:
+            try:
+                client.files.delete(name=entry[1].name)
+            except Exception as e:
+                print(f"Could not delete uploaded file {entry[1].name}: {e}")
+
+def _extract_uploaded_pdf(pdf_file, prompt, digest):
+    """
+    Run the prompt against a PDF uploaded through Gemini's File API
+    
+    pdf_file is a path or a binary file object. The raw file is sent
+    (resumable upload) rather than base64-encoded inline data, once per
+    content digest (see _uploaded_pdf).
+    """
+    uploaded = _uploaded_pdf(digest, pdf_file)
+    try:
+        response = gemini_api_with_retry(
+            model=GEMINI_MODEL,
+            contents=[types.Part.from_uri(file_uri=uploaded.uri, mime_type='application/pdf'), prompt]
+        )
+    except Exception:
+        # The handle may have expired server-side; upload afresh next time
+        with _uploaded_pdfs_lock:
+            _uploaded_pdfs.pop(digest, None)
+        raise
+    return response.text
+
+def _extract_pdf_bytes(pdf_content, prompt, digest=None):
+    """
+    Run the prompt against in-memory PDF bytes without writing them to disk
+    
+    The bytes are sent inline up to PDF_INLINE_LIMIT_BYTES; larger PDFs are
+    uploaded through the File API from memory.
+    """
+    if len(pdf_content) > PDF_INLINE_LIMIT_BYTES:
+        digest = digest or hashlib.sha256(pdf_content).hexdigest()
+        return _extract_uploaded_pdf(io.BytesIO(pdf_content), prompt, digest)
+    
+    response = gemini_api_with_retry(
+        model=GEMINI_MODEL,
+        contents=[
+            types.Part.from_bytes(data=pdf_content, mime_type='application/pdf'),
+            prompt
+        ]
+    )
+    return response.text
+
+def extract_pdf_text_locally(pdf_content):
+    """
+    Extract the embedded text layer of a PDF without calling Gemini
+    
+    Args:
+        pdf_content: PDF bytes or a path to the PDF on disk
         
-        # Create a prompt to extract text and information from the PDF
-        prompt = "Please extract all text content from this PDF document, including text from tables, diagrams, and charts."
+    Returns:
+        tuple: (text, page_count)
+    """
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_content)
+        try:
+            texts = []
+            for i in range(len(pdf)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            return "\n".join(texts), len(pdf)
+        finally:
+            pdf.close()
+
+def pdf_text_covered_by(pdf_text, reference_text):
+    """
+    Check whether a PDF's text adds little beyond text we already have
+    (e.g. a letterhead / signature PDF that repeats the email body).
+    
+    The PDF text counts as covered when at least PDF_COVERED_RATIO of its
+    characters sit on lines that also appear in reference_text. A short PDF
+    is judged the same way, so a title block the email doesn't repeat is
+    never counted as covered.
+    """
+    lines = [" ".join(line.split()).lower() for line in pdf_text.splitlines()]
+    lines = [line for line in lines if line]
+    total_chars = sum(len(line) for line in lines)
+    if not reference_text or total_chars < PDF_MIN_TEXT_CHARS:
+        # No email to compare against, or no real text layer (scanned PDF)
+        return False
+    
+    reference = " ".join(reference_text.split()).lower()
+    unique_chars = sum(len(line) for line in lines if line not in reference)
+    return 1 - unique_chars / total_chars >= PDF_COVERED_RATIO
+
+def pdf_lines_not_in(pdf_text, reference_text):
+    """The lines of a PDF's text that don't appear in reference_text, joined back together"""
+    reference = " ".join(reference_text.split()).lower()
+    return "\n".join(
+        line for line in pdf_text.splitlines()
+        if line.strip() and " ".join(line.split()).lower() not in reference
+    )
+
+def extract_pdfs_smart(pdf_files, reference_text=""):
+    """
+    Use each PDF's own text layer when it is good enough (at least
+    PDF_LOCAL_MIN_CHARS, at PDF_TEXT_CONFIDENCE_THRESHOLD of a full page per
+    page), otherwise fall back to Gemini vision (scanned drawings,
+    image-only pages). The PDFs that still need Gemini are extracted
+    together, in one call when they fit inline (see _extract_pdf_files).
+    
+    When reference_text (e.g. the email bodies uploaded alongside) already
+    covers a PDF's text, no Gemini call is made: only its lines missing from
+    reference_text are returned, or None when there are none.
+    The method taken is appended to st.session_state["pdf_method_log"].
+    
+    Args:
+        pdf_files: List of PDF file data ('filename' and 'content' or 'path')
+        reference_text: Text that makes a PDF redundant when it covers it
         
-        # Process the PDF with Gemini using the client approach
-        with open(temp_file_path, 'rb') as f:
-            pdf_data = f.read()
-            
-            # Use retry function instead of direct API call
-            response = gemini_api_with_retry(
-                model="gemini-2.5-flash-preview-04-17",
-                contents=[
-                    types.Part.from_bytes(
-                        data=pdf_data,
-                        mime_type='application/pdf',
-                    ),
-                    prompt
-                ]
-            )
-            
-        return response.text
-    except Exception as e:
-        st.error(f"Error processing PDF with Gemini: {e}")
-        return f"Error processing PDF: {str(e)}"
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+    Returns:
+        list: Extracted text per PDF, in input order (None when skipped)
+    """
+    texts, log, needs_gemini = [], [], []
+    for i, pdf_file in enumerate(pdf_files):
+        start = time.perf_counter()
+        text, pages, score = "", 0, 0.0
+        try:
+            text, pages = extract_pdf_text_locally(pdf_file.get('path') or pdf_file['content'])
+            if pages:
+                score = len(text.strip()) / (pages * PDF_EXPECTED_CHARS_PER_PAGE)
+        except Exception as e:
+            print(f"Local text extraction failed for {pdf_file['filename']}: {e}")
+        
+        if pdf_text_covered_by(text, reference_text):
+            # Whatever the email doesn't repeat is kept; only a fully repeated PDF is dropped
+            text = pdf_lines_not_in(text, reference_text) or None
+            method = "local" if text else "skipped"
+        elif score >= PDF_TEXT_CONFIDENCE_THRESHOLD and len(text.strip()) >= PDF_LOCAL_MIN_CHARS:
+            method = "local"
+        else:
+            method = "gemini"
+            needs_gemini.append(i)
+        texts.append(text)
+        log.append({
+            "filename": pdf_file['filename'],
+            "method": method,
+            "pages": pages,
+            "confidence": round(score, 2),
+            "seconds": time.perf_counter() - start,
+        })
+    
+    if needs_gemini:
+        # The Gemini time is shared by the PDFs extracted together
+        start = time.perf_counter()
+        digests, gemini_texts = _extract_pdf_files([pdf_files[i] for i in needs_gemini])
+        share = (time.perf_counter() - start) / len(needs_gemini)
+        for i, digest in zip(needs_gemini, digests):
+            text = gemini_texts[digest]
+            texts[i] = f"Error processing PDF: {str(text)}" if isinstance(text, Exception) else text
+            log[i]["seconds"] += share
+    
+    for entry in log:
+        entry["seconds"] = round(entry["seconds"], 3)
+    st.session_state.setdefault("pdf_method_log", []).extend(log)
+    return texts
 
 def process_multiple_pdfs(pdf_files):
     """
     Process multiple PDF files with Gemini
     
+    Identical PDFs (same bytes under one or more filenames) are sent once.
+    When the unique PDFs fit in one inline request they are extracted by a
+    single Gemini call; otherwise (or if that response can't be split back
+    per PDF) they go concurrently, up to MAX_ATTACHMENT_WORKERS at a time.
+    Every filename gets its section, in input order.
+    
     Args:
         pdf_files: List of PDF file data (content and filename)
         
     Returns:
         combined_text: Combined text from all PDFs
     """
-    combined_text = ""
+    if not pdf_files:
+        return ""
+    
+    digests, texts = _extract_pdf_files(pdf_files)
     
-    for pdf_file in pdf_files:
+    sections = []
+    for digest, pdf_file in zip(digests, pdf_files):
         filename = pdf_file['filename']
-        content = pdf_file['content']
-        
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-        
-        try:
-            # Process the PDF with Gemini using the client approach
-            with open(temp_file_path, 'rb') as f:
-                pdf_data = f.read()
-                
-                response = gemini_api_with_retry(
-                    model="gemini-2.5-flash-preview-04-17",
-                    contents=[
-                        types.Part.from_bytes(
-                            data=pdf_data,
-                            mime_type='application/pdf',
-                        ),
-                        "Extract all text and information from this PDF document."
-                    ]
-                )
-                
-            combined_text += f"\nPDF ATTACHMENT ({filename}):\n{response.text}\n\n"
-        
-        except Exception as e:
-            st.error(f"Error processing PDF {filename} with Gemini: {e}")
-            combined_text += f"\nPDF ATTACHMENT ({filename}) [Error: {str(e)}]\n\n"
+        if isinstance(texts[digest], Exception):
+            sections.append(f"\nPDF ATTACHMENT ({filename}) [Error: {str(texts[digest])}]\n\n")
+        else:
+            sections.append(f"\nPDF ATTACHMENT ({filename}):\n{texts[digest]}\n\n")
+    
+    return "".join(sections)
+
+def _extract_pdf_files(pdf_files):
+    """
+    Gemini text of each PDF in pdf_files, for process_multiple_pdfs and extract_pdfs_smart
+    
+    Identical PDFs (same bytes under one or more filenames) are sent once.
+    
+    Returns:
+        tuple: (content digest per PDF in input order, dict of digest ->
+               extracted text or the exception raised extracting it)
+    """
+    digests = [_attachment_digest(pdf_file) for pdf_file in pdf_files]
+    unique = {}
+    for digest, pdf_file in zip(digests, pdf_files):
+        unique.setdefault(digest, pdf_file)
+    
+    # digest -> extracted text, or the exception raised extracting it; PDFs
+    # already extracted (this or an earlier session) come from the PDF cache
+    texts = {}
+    for digest in unique:
+        cached = _pdf_cache_get(digest, GEMINI_MODEL)
+        if cached is not None:
+            texts[digest] = cached
+    pending = {digest: pdf_file for digest, pdf_file in unique.items() if digest not in texts}
+    
+    fresh = None
+    if len(pending) > 1:
+        # The batch holds every pending PDF's lock, so another email carrying the
+        # same PDFs waits for this request and then reads the cache
+        with _pdf_digest_locks_held(pending):
+            for digest in list(pending):
+                cached = _pdf_cache_get(digest, GEMINI_MODEL)
+                if cached is not None:
+                    texts[digest] = cached
+                    del pending[digest]
+            fresh = _batched_pdf_texts(pending) if len(pending) > 1 else None
+            for digest, text in (fresh or {}).items():
+                _pdf_cache_put(digest, GEMINI_MODEL, text)
+    if pending and fresh is None:
+        fresh = {}
+        ctx = get_script_run_ctx()
+        workers = min(MAX_ATTACHMENT_WORKERS, len(pending))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {digest: executor.submit(_gemini_pdf_text, pdf_file, digest, ctx) for digest, pdf_file in pending.items()}
+            for digest, future in futures.items():
+                try:
+                    fresh[digest] = future.result()
+                except Exception as e:
+                    st.error(f"Error processing PDF {pending[digest]['filename']} with Gemini: {e}")
+                    fresh[digest] = e
+    texts.update(fresh or {})
+    return digests, texts
+
+def _attachment_size(item):
+    """Size in bytes of an attachment held in memory or spooled to disk"""
+    return os.path.getsize(item['path']) if 'path' in item else len(item['content'])
+
+def _attachment_bytes(item):
+    """Bytes of an attachment held in memory or spooled to disk"""
+    if 'path' in item:
+        with open(item['path'], 'rb') as f:
+            return f.read()
+    return item['content']
+
+def _batched_pdf_texts(unique):
+    """Extract several PDFs (dict of content digest -> PDF file data) with one Gemini call"""
+    return _batched_gemini_texts(
+        unique, "PDF", PDF_BATCH_SEPARATOR,
+        "Extract all text and information from each PDF document above.",
+        _attachment_size,
+        lambda pdf_file: types.Part.from_bytes(data=_attachment_bytes(pdf_file), mime_type='application/pdf'),
+    )
+
+def _batched_gemini_texts(unique, label, separator, instruction, size_of, part_of):
+    """
+    Send several files to Gemini in one call and split the response per file
+    
+    Each file is introduced as '<label> N (filename):' and its output is
+    asked to start with a '===<label> N===' line, which separator matches.
+    
+    Args:
+        unique: Dict of content digest -> file data
+        label: Name the files are numbered under ("PDF", "IMAGE")
+        separator: Compiled pattern for the '===<label> N===' lines, capturing N
+        instruction: What to do with each file
+        size_of: Function giving a file's size in bytes
+        part_of: Function giving a file's types.Part
         
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+    Returns:
+        dict: digest -> text, or None when the files are too large for one
+              inline request, the call fails, or the response can't be split
+              into a non-empty section per file
+    """
+    if sum(size_of(file) for file in unique.values()) > PDF_INLINE_LIMIT_BYTES:
+        return None
+    
+    contents = []
+    for n, file in enumerate(unique.values(), start=1):
+        contents.append(f"{label} {n} ({file['filename']}):")
+        contents.append(part_of(file))
+    contents.append(
+        f"{instruction} Start the output for each file with a line containing only '==={label} N===', "
+        "where N is the file's number, and cover the files in order."
+    )
+    
+    try:
+        response = gemini_api_with_retry(model=GEMINI_MODEL, contents=contents)
+    except Exception as e:
+        print(f"Batched {label} request failed, sending files one by one: {e}")
+        return None
+    
+    pieces = separator.split(response.text or "")
+    by_number = {int(number): text.strip() for number, text in zip(pieces[1::2], pieces[2::2])}
+    if set(by_number) != set(range(1, len(unique) + 1)) or not all(by_number.values()):
+        print(f"Batched {label} response could not be split per file, sending files one by one")
+        return None
+    return {digest: by_number[n] for n, digest in enumerate(unique, start=1)}
+
+def _gemini_pdf_text(pdf_file, digest, ctx=None):
+    """Send one PDF of process_multiple_pdfs to Gemini and return the response text"""
+    # Worker threads need the Streamlit run context for gemini_api_with_retry's st.warning
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+    
+    prompt = PDF_EXTRACT_PROMPT
     
-    return combined_text
+    with _pdf_digest_lock(digest):
+        # Another email may have extracted the same PDF while this one waited
+        cached = _pdf_cache_get(digest, GEMINI_MODEL)
+        if cached is not None:
+            return cached
+        
+        # Spooled attachments are uploaded from their own file when too big to send inline
+        if 'path' in pdf_file and _attachment_size(pdf_file) > PDF_INLINE_LIMIT_BYTES:
+            text = _extract_uploaded_pdf(pdf_file['path'], prompt, digest)
+        else:
+            text = _extract_pdf_bytes(_attachment_bytes(pdf_file), prompt, digest)
+        _pdf_cache_put(digest, GEMINI_MODEL, text)
+        return text
 
 def process_multiple_images(image_files, image_type="ATTACHMENT"):
     """
     Process multiple image files with Gemini
     
+    The images are described together (see describe_images); their
+    sections are joined in input order.
+    
     Args:
         image_files: List of image file data (content and filename)
         image_type: Type of image (ATTACHMENT or INLINE IMAGE)
@@ -230,64 +1087,91 @@ def process_multiple_images(image_files, image_type="ATTACHMENT"):
     Returns:
         combined_text: Combined text from image analysis
     """
-    combined_text = ""
+    if not image_files:
+        return ""
     
-    for image_file in image_files:
-        filename = image_file['filename']
-        content = image_file['content']
-        file_extension = filename.split(".")[-1].lower()
-        
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(suffix=f'.{file_extension}', delete=False) as temp_file:
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-        
-        try:
-            # Process the image with Gemini using the client approach
-            with open(temp_file_path, 'rb') as f:
-                image_data = f.read()
-                
-                response = gemini_api_with_retry(
-                    model="gemini-2.5-flash-preview-04-17",
-                    contents=[
-                        types.Part.from_bytes(
-                            data=image_data,
-                            mime_type=f'image/{file_extension}',
-                        ),
-                        "Describe this image in detail, including any visible text, diagrams, or drawings. Extract any technical parameters or specifications you can see."
-                    ]
-                )
-                
-            combined_text += f"\n{image_type} ({filename}):\n{response.text}\n\n"
-        
-        except Exception as e:
-            st.error(f"Error processing image {filename} with Gemini: {e}")
-            combined_text += f"\n{image_type} ({filename}) [Error: {str(e)}]\n\n"
+    texts = describe_images(image_files)
+    return "".join(
+        f"\n{image_type} ({image_file['filename']}):\n{text}\n\n"
+        for image_file, text in zip(image_files, texts)
+    )
+
+def describe_images(image_files):
+    """
+    Describe several images with Gemini and return the descriptions in order
+    
+    Images without a cached description are sent in one request when there
+    is more than one and they fit inline together; anything the batch didn't
+    cover goes through process_image_with_gemini, concurrently.
+    
+    Args:
+        image_files: List of image file data (content and filename)
         
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+    Returns:
+        list: One description (or error message) per image
+    """
+    if not image_files:
+        return []
     
-    return combined_text
+    unique = {}
+    for image_file in image_files:
+        digest = hashlib.sha256(image_file['content']).hexdigest()
+        if _image_mime_type(image_file['filename']) and _pdf_cache_get(digest, GEMINI_MODEL) is None:
+            unique.setdefault(digest, image_file)
+    if len(unique) > 1:
+        # Held across the batch so another email with the same images waits and reads the cache
+        with _pdf_digest_locks_held(unique):
+            unique = {digest: image_file for digest, image_file in unique.items() if _pdf_cache_get(digest, GEMINI_MODEL) is None}
+            for digest, text in ((_batched_image_texts(unique) if len(unique) > 1 else None) or {}).items():
+                _pdf_cache_put(digest, GEMINI_MODEL, text)
+    
+    # Batched descriptions are now cached, so these are cache hits
+    ctx = get_script_run_ctx()
+    workers = min(MAX_ATTACHMENT_WORKERS, len(image_files))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda image_file: _describe_image(image_file, ctx), image_files))
+
+def _describe_image(image_file, ctx=None):
+    """Describe one image of describe_images with Gemini"""
+    # Worker threads need the Streamlit run context for gemini_api_with_retry's st.warning
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+    return process_image_with_gemini(image_file['content'], image_file['filename'])
+
+def _image_mime_type(filename):
+    """MIME type Gemini is sent for an image filename, or None if the format isn't supported"""
+    return IMAGE_MIME_TYPES.get(filename.split(".")[-1].lower())
+
+def _batched_image_texts(unique):
+    """Describe several images (dict of content digest -> image file data) with one Gemini call"""
+    return _batched_gemini_texts(
+        unique, "IMAGE", IMAGE_BATCH_SEPARATOR,
+        IMAGE_DESCRIBE_PROMPT + " Do this for each image above.",
+        lambda image_file: len(image_file['content']),
+        lambda image_file: types.Part.from_bytes(data=image_file['content'], mime_type=_image_mime_type(image_file['filename'])),
+    )
 
 def extract_text_from_email(email_text, attachments_data, inline_images=None):
-    """Extracts all text from email and attachments returns as a single string."""
-    combined_text = f"EMAIL CONTENT:\n{email_text}\n\n"
+    """
+    Extracts all text from email and attachments returns as a single string.
+    """
+    # Sections are collected in a list and joined once at the end
+    sections = [f"EMAIL CONTENT:\n{email_text}\n\n"]
     
-    # For non-visual content attachments, just note they exist
+    # Sort attachments by extension with one lookup each
+    pdf_attachments, image_attachments = [], []
     for attachment in attachments_data:
         filename = attachment['filename']
-        if not (filename.lower().endswith(".pdf") or 
-                filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp'))):
-            combined_text += f"\nATTACHMENT ({filename}) [Not processed - not a PDF or image]\n\n"
-    
-    # Limit the total number of visual items to process to avoid rate limits
-    MAX_VISUAL_ITEMS = 10
-    
-    # Collect all visual attachments
-    pdf_attachments = [a for a in attachments_data if a['filename'].lower().endswith(".pdf")]
-    image_attachments = [a for a in attachments_data if a['filename'].lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp'))]
+        kind = ATTACHMENT_KINDS.get(os.path.splitext(filename)[1].lower())
+        if attachment.get('skipped_reason') == 'oversize':
+            sections.append(f"\nATTACHMENT ({filename}) [Not processed - larger than {MAX_ATTACHMENT_BYTES // (1024 * 1024)} MB]\n\n")
+        elif kind == 'pdf':
+            pdf_attachments.append(attachment)
+        elif kind == 'image':
+            image_attachments.append(attachment)
+        else:
+            # For non-visual content attachments, just note they exist
+            sections.append(f"\nATTACHMENT ({filename}) [Not processed - not a PDF or image]\n\n")
     
     all_visual_items = []
     
@@ -305,115 +1189,253 @@ def extract_text_from_email(email_text, attachments_data, inline_images=None):
     
     # Note skipped items
     if skipped_items:
-        combined_text += "\nNOTE: Some visual elements were not processed due to API rate limits:\n"
-        for item_type, item in skipped_items:
-            combined_text += f"- {item_type.upper()}: {item['filename']}\n"
-        combined_text += "\n"
-    
-    # Process the limited set of items
-    for item_type, item in processed_items:
-        if item_type == 'pdf':
-            # Process this PDF
-            with st.spinner(f"Processing PDF: {item['filename']}..."):
-                pdf_text = process_pdf_with_gemini(item['content'], item['filename'])
-                combined_text += f"\nPDF ATTACHMENT ({item['filename']}):\n{pdf_text}\n\n"
-        elif item_type == 'inline':
-            # Process this inline image
-            with st.spinner(f"Processing inline image: {item['filename']}..."):
-                image_text = process_image_with_gemini(item['content'], item['filename'], "INLINE IMAGE")
-                combined_text += f"\nINLINE IMAGE ({item['filename']}):\n{image_text}\n\n"
-        elif item_type == 'image':
-            # Process this image attachment
-            with st.spinner(f"Processing image: {item['filename']}..."):
-                image_text = process_image_with_gemini(item['content'], item['filename'], "ATTACHMENT")
-                combined_text += f"\nIMAGE ATTACHMENT ({item['filename']}):\n{image_text}\n\n"
-    
-    return combined_text
+        sections.append("\nNOTE: Some visual elements were not processed due to API rate limits:\n")
+        sections.extend(f"- {item_type.upper()}: {item['filename']}\n" for item_type, item in skipped_items)
+        sections.append("\n")
+    
+    # Process the limited set of items concurrently. Identical attachments (the same
+    # drawing attached twice, or under two names) are sent to Gemini once and their
+    # text is repeated under each filename, in attachment order
+    if processed_items:
+        keys = [(item_type, _attachment_digest(item)) for item_type, item in processed_items]
+        unique = {}
+        for key, entry in zip(keys, processed_items):
+            unique.setdefault(key, entry)
+        
+        # The PDFs go to Gemini together as one task and the images as another, side by side
+        pdf_keys = [key for key in unique if key[0] == 'pdf']
+        image_keys = [key for key in unique if key[0] != 'pdf']
+        texts = {}
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pdf_future = executor.submit(_process_pdf_items, [unique[key][1] for key in pdf_keys], ctx) if pdf_keys else None
+            image_future = executor.submit(_process_image_items, [unique[key][1] for key in image_keys], ctx) if image_keys else None
+            if image_future is not None:
+                texts.update(zip(image_keys, image_future.result()))
+            if pdf_future is not None:
+                texts.update(zip(pdf_keys, pdf_future.result()))
+        
+        sections.extend(
+            f"\n{VISUAL_ITEM_LABELS[item_type]} ({item['filename']}):\n{texts[key]}\n\n"
+            for key, (item_type, item) in zip(keys, processed_items)
+        )
+    
+    return "".join(sections)
+
+# Section heading used for each kind of visual item in the combined text
+VISUAL_ITEM_LABELS = {
+    'pdf': "PDF ATTACHMENT",
+    'inline': "INLINE IMAGE",
+    'image': "IMAGE ATTACHMENT",
+}
+
+def _process_pdf_items(pdf_items, ctx=None):
+    """Extract an email's PDF attachments together and return their texts in order"""
+    # Worker threads need the Streamlit run context for st.spinner / st.error
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+    
+    with st.spinner(f"Processing {len(pdf_items)} PDF(s)..."):
+        # Text-layer PDFs are read locally; scanned ones still go to Gemini
+        return extract_pdfs_smart(pdf_items)
+
+def _process_image_items(image_items, ctx=None):
+    """Describe an email's images (attachments and inline) together and return their texts in order"""
+    # Worker threads need the Streamlit run context for st.spinner
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+    
+    with st.spinner(f"Processing {len(image_items)} image(s)..."):
+        return describe_images(image_items)
 
 # Helper function to process a single image
 def process_image_with_gemini(image_content, filename, image_type="ATTACHMENT"):
     """Process a single image with Gemini"""
-    # Define supported image formats and their MIME types
-    SUPPORTED_FORMATS = {
-        'jpg': 'image/jpeg',
-        'jpeg': 'image/jpeg',
-        'png': 'image/png',
-        'webp': 'image/webp'
-    }
-    
     file_extension = filename.split(".")[-1].lower()
     
     # Validate file format
-    if file_extension not in SUPPORTED_FORMATS:
-        return f"Unsupported image format: {file_extension}. Only {', '.join(SUPPORTED_FORMATS.keys())} are supported."
+    if file_extension not in IMAGE_MIME_TYPES:
+        return f"Unsupported image format: {file_extension}. Only {', '.join(IMAGE_MIME_TYPES.keys())} are supported."
     
     # Get proper MIME type
-    mime_type = SUPPORTED_FORMATS[file_extension]
+    mime_type = IMAGE_MIME_TYPES[file_extension]
     
-    # Create a temporary file
-    with tempfile.NamedTemporaryFile(suffix=f'.{file_extension}', delete=False) as temp_file:
-        temp_file.write(image_content)
-        temp_file_path = temp_file.name
+    # The same logo or screenshot often appears in every email of a thread, and
+    # reruns resend it, so descriptions are cached by content hash like PDFs
+    digest = hashlib.sha256(image_content).hexdigest()
+    cached = _pdf_cache_get(digest, GEMINI_MODEL)
+    if cached is not None:
+        return cached
     
     try:
-        # Process the image with Gemini using the client approach
-        with open(temp_file_path, 'rb') as f:
-            image_data = f.read()
-            
-            # Use a try/except block specifically for this API call
-            try:
+        # Send the image bytes inline; they are already in memory, so no temp-file round-trip
+        try:
+            with _pdf_digest_lock(digest):
+                cached = _pdf_cache_get(digest, GEMINI_MODEL)
+                if cached is not None:
+                    return cached
                 response = gemini_api_with_retry(
-                    model="gemini-2.5-flash-preview-04-17",
+                    model=GEMINI_MODEL,
                     contents=[
                         types.Part.from_bytes(
-                            data=image_data,
+                            data=image_content,
                             mime_type=mime_type,
                         ),
-                        "Describe this image in detail, including any visible text, diagrams, or drawings. Extract any technical parameters or specifications you can see."
+                        IMAGE_DESCRIBE_PROMPT
                     ]
                 )
-                
-                return response.text
-            except Exception as e:
-                error_message = str(e)
-                # Check if it's specifically a format issue
-                if "INVALID_ARGUMENT" in error_message:
-                    return f"Unable to process this image due to format compatibility issues. Please note any visible information from the image might not be included in the analysis."
-                else:
-                    raise e  # Re-raise the exception for other types of errors
+                if response.text:
+                    _pdf_cache_put(digest, GEMINI_MODEL, response.text)
+            
+            return response.text
+        except Exception as e:
+            error_message = str(e)
+            # Check if it's specifically a format issue
+            if "INVALID_ARGUMENT" in error_message:
+                return f"Unable to process this image due to format compatibility issues. Please note any visible information from the image might not be included in the analysis."
+            else:
+                raise e  # Re-raise the exception for other types of errors
     
     except Exception as e:
         # Use logging instead of st.error
         print(f"Error processing image {filename} with Gemini: {e}")
         return f"Error processing image: {str(e)}"
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
 
 def query_llm(all_text, query):
     """
     Sends the extracted text and query to Gemini.
+    
+    Text longer than QUERY_CHUNK_CHARS is split at the per-file separators
+    into chunks that are analysed concurrently; their answers are merged by
+    taking the first real value found for each parameter.
+    
+    Returns:
+        str: JSON object text with one string value per name in PARAM_NAMES
     """
-    # Construct a prompt that includes both the context and the query
-    prompt = f"""
-    Please analyze the following information extracted from emails, PDF documents, and images:
+    chunks = _split_extracted_text(all_text, QUERY_CHUNK_CHARS)
     
-    {all_text}
+    # Get a structured response from Gemini, served from the response cache when possible
+    with st.spinner("Analyzing Results..."):
+        if len(chunks) == 1:
+            corpus = dedupe_repeated_blocks(all_text)
+            cache_name = corpus_context_cache(corpus)
+            if cache_name:
+                text = cached_llm(GEMINI_MODEL, _params_question(query), response_schema=PARAMS_SCHEMA, cached_content=cache_name)
+            else:
+                text = cached_llm(GEMINI_MODEL, _params_prompt(corpus, query), response_schema=PARAMS_SCHEMA)
+        else:
+            ctx = get_script_run_ctx()
+            with ThreadPoolExecutor(max_workers=min(MAX_ATTACHMENT_WORKERS, len(chunks))) as executor:
+                answers = list(executor.map(lambda chunk: _query_chunk(chunk, query, ctx), chunks))
+            succeeded = [answer for answer in answers if answer is not None]
+            if not succeeded:
+                raise RuntimeError(f"Parameter query failed for all {len(chunks)} chunks of the extracted text")
+            # Failed chunks aren't in the response cache, so the next run retries them
+            text = json.dumps(_merge_param_answers(succeeded))
+    return text
+
+def _params_prompt(text, query):
+    """
+    Prompt asking Gemini to answer the parameter query from the extracted text
     
+    The query and instructions, identical on every submission and for every
+    chunk, come first so Gemini's implicit prefix caching can reuse them;
+    the per-submission text follows.
+    """
+    return f"""{_params_question(query)}
+    {CORPUS_CACHE_PREAMBLE}{text}
+    """
+
+def _params_question(query):
+    """The question part of the parameter prompt, sent alone when the text is in a context cache"""
+    return f"""
     QUESTION: {query}
     
     Note that information may be found in any of the content sources, including text from image descriptions.
+    Answer with one value per parameter; use 'Not found' when a parameter cannot be determined.
+    """
+
+def dedupe_repeated_blocks(text):
     """
+    Replace repeated blocks of lines (signatures, disclaimers, quoted
+    forwards) with a short pointer to their first occurrence
     
-    # Get response from Gemini using the client approach
-    with st.spinner("Analyzing Results..."):
-        response = gemini_api_with_retry(
-            model="gemini-2.5-flash-preview-04-17",
-            contents=prompt
-        )
+    Lines are grouped into content-defined blocks: a block ends after a
+    line whose CRC32 is divisible by DEDUP_BLOCK_DIVISOR, so the same run
+    of lines splits the same way wherever it appears. A block of at least
+    DEDUP_MIN_BLOCK_CHARS seen earlier is replaced by [DUP#<id>]; its first
+    occurrence is tagged [BLOCK#<id>] so the pointer can be followed.
+    """
+    blocks, current = [], []
+    for line in text.splitlines(keepends=True):
+        current.append(line)
+        if zlib.crc32(line.strip().encode("utf-8")) % DEDUP_BLOCK_DIVISOR == 0:
+            blocks.append("".join(current))
+            current = []
+    if current:
+        blocks.append("".join(current))
     
-    return response.text
+    counts = {}
+    for block in blocks:
+        if len(block) >= DEDUP_MIN_BLOCK_CHARS:
+            counts[block] = counts.get(block, 0) + 1
+    
+    seen = set()
+    out = []
+    for block in blocks:
+        if counts.get(block, 0) < 2:
+            out.append(block)
+            continue
+        block_id = hashlib.sha256(block.encode("utf-8")).hexdigest()[:8]
+        if block_id in seen:
+            out.append(f"[DUP#{block_id}]\n")
+        else:
+            seen.add(block_id)
+            out.append(f"[BLOCK#{block_id}]\n{block}")
+    return "".join(out)
+
+def _split_extracted_text(all_text, max_chars):
+    """
+    Split the combined extracted text into chunks of at most max_chars,
+    cutting only after a per-file separator line; a single file larger
+    than max_chars becomes a chunk of its own
+    """
+    if len(all_text) <= max_chars:
+        return [all_text]
+    
+    pieces = all_text.split(FILE_SEPARATOR)
+    pieces = [piece + FILE_SEPARATOR for piece in pieces[:-1]] + ([pieces[-1]] if pieces[-1] else [])
+    
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + len(piece) > max_chars:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def _query_chunk(chunk, query, ctx=None):
+    """Answer the parameter query for one chunk; returns the parsed JSON dict (None on failure)"""
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+    try:
+        prompt = _params_prompt(dedupe_repeated_blocks(chunk), query)
+        return json.loads(cached_llm(GEMINI_MODEL, prompt, response_schema=PARAMS_SCHEMA))
+    except Exception as e:
+        print(f"Chunk analysis failed: {e}")
+        return None
+
+def _merge_param_answers(answers):
+    """First value per parameter that isn't empty or a 'Not found' / 'Not provided' placeholder"""
+    merged = {}
+    for name in PARAM_NAMES:
+        values = [str(answer.get(name) or "").strip() for answer in answers if isinstance(answer, dict)]
+        found = [v for v in values if v and v.lower() not in MISSING_VALUES]
+        merged[name] = found[0] if found else (next((v for v in values if v), "Not found"))
+    return merged
 
 def process_msg_file(msg_file_path):
     """
@@ -427,9 +1449,23 @@ def process_msg_file(msg_file_path):
       attachments_data: list of dictionaries with attachment data.
       inline_images: list of dictionaries with inline image data.
     """
+    # extract_msg is only imported once an Outlook message is actually uploaded
+    import extract_msg
+    
     # Open and parse the Outlook message file
-    msg = extract_msg.Message(msg_file_path)
+    return _extract_outlook_message(extract_msg.Message(msg_file_path))
+
+def process_msg_bytes(msg_data):
+    """
+    Same as process_msg_file, but parses the raw .msg bytes in memory
+    instead of reading them from disk.
+    """
+    import extract_msg
     
+    return _extract_outlook_message(extract_msg.Message(msg_data))
+
+def _extract_outlook_message(msg):
+    """Pull header, body, attachments and inline images out of an opened Outlook message"""
     try:
         # Extract header fields
         header_info = (
@@ -442,6 +1478,9 @@ def process_msg_file(msg_file_path):
         # Extract the email body
         body = msg.body
         
+        # HTML body decoded once, for the inline-image check below
+        html_body = msg.htmlBody.decode('utf-8', errors='ignore') if getattr(msg, 'htmlBody', None) else ""
+        
         # Process attachments and inline images
         attachments_data = []
         inline_images = []
@@ -449,18 +1488,28 @@ def process_msg_file(msg_file_path):
         for attachment in msg.attachments:
             filename = attachment.longFilename or attachment.shortFilename
             if filename:
+                # Only PDFs and images are processed, so other attachments are
+                # noted without their data ever being read out of the file
+                if os.path.splitext(filename)[1].lower() not in ATTACHMENT_KINDS:
+                    attachments_data.append({'filename': filename, 'content': None})
+                    continue
+                size = _outlook_attachment_size(attachment)
+                if size is not None and size > MAX_ATTACHMENT_BYTES:
+                    attachments_data.append({'filename': filename, 'content': None, 'skipped_reason': 'oversize'})
+                    continue
+                
                 # Try to determine if it's an inline image
                 is_inline = False
                 
                 # Look for typical image extensions and check if it might be inline
                 # Outlook msg format doesn't clearly distinguish inline vs attachment 
                 # so we'll use heuristics
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp')):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
                     # Check if there's a content ID or if it's referenced in HTML
                     # This is a heuristic approach
                     if hasattr(attachment, 'cid') and attachment.cid:
                         is_inline = True
-                    elif hasattr(msg, 'htmlBody') and msg.htmlBody and filename in msg.htmlBody.decode('utf-8', errors='ignore'):
+                    elif filename in html_body:
                         is_inline = True
                         
                 if is_inline:
@@ -472,11 +1521,7 @@ def process_msg_file(msg_file_path):
                     }
                     inline_images.append(inline_image_data)
                 else:
-                    attachment_data = {
-                        'filename': filename,
-                        'content': attachment.data
-                    }
-                    attachments_data.append(attachment_data)
+                    attachments_data.append(_attachment_entry(filename, attachment.data))
         
         return header_info, body, attachments_data, inline_images
     
@@ -484,36 +1529,39 @@ def process_msg_file(msg_file_path):
         # Close the msg file to release the file handle
         msg.close()
 
-def extract_project_name_from_content(email_text, attachments_data):
+def _outlook_attachment_size(attachment):
+    """Size of an Outlook attachment from its properties, or None if not recorded"""
+    props = getattr(attachment, 'props', None)
+    prop = props.get(PR_ATTACH_SIZE) if props is not None else None
+    return getattr(prop, 'value', None)
+
+def extract_project_name_from_content(email_text, attachments_data, combined_text=None):
     """
     Extract the project name from email content and attachments
     
+    Args:
+        combined_text: Already extracted text to search; defaults to
+            st.session_state.all_extracted_text
+    
     Returns:
         str: The extracted project name
     """
     # Use already extracted text if available (to avoid reprocessing)
-    if hasattr(st.session_state, 'all_extracted_text') and st.session_state.all_extracted_text:
+    if not combined_text and hasattr(st.session_state, 'all_extracted_text') and st.session_state.all_extracted_text:
         combined_text = st.session_state.all_extracted_text
-    else:
+    if not combined_text:
         # Fallback to extracting text if not already done
         combined_text = extract_text_from_email(email_text, attachments_data)
     
-    # Create a focused prompt for the LLM
+    # Send to Gemini for analysis (deterministic, so a repeat over the same text is a cache hit).
+    # The text goes inline: a context cache is only created once query_llm or the chat needs it,
+    # which an email matched to an existing Monday.com project never does
     prompt = f"""
-    Based on the following email content and attachments, extract the project name (drawing title) which is usually the project location.
-    Return only the project name, nothing else.
+    {PROJECT_NAME_QUERY}
     
-    {combined_text}
+    {dedupe_repeated_blocks(combined_text)}
     """
-    
-    # Send to Gemini for analysis
-    response = gemini_api_with_retry(
-        model="gemini-2.5-flash-preview-04-17",
-        contents=prompt
-    )
-    
-    # Return the response as the project name
-    return response.text.strip()
+    return cached_llm(GEMINI_MODEL, prompt).strip()
 
 def extract_parameters_from_monday_project(project_details):
     """
@@ -543,18 +1591,18 @@ def extract_parameters_from_monday_project(project_details):
         "Decking": "Not found"
     }
     
-    # First, extract data from main project item
-    for col in project_details.get('column_values', []):
-        # Extract Post Code from dropdown_mknfpjbt column (Zip Code)
-        if col.get('id') == "dropdown_mknfpjbt" and col.get('text'):
-            params["Post Code"] = col.get('text')
-        
-        # Extract Project Name
-        elif col.get('id') == "text3__1":  # Project Name column
-            if col.get('text'):
-                params["Drawing Title"] = col.get('text')
-            elif col.get('__typename') == "MirrorValue" and col.get('display_value'):
-                params["Drawing Title"] = col.get('display_value')
+    # First, extract data from main project item (columns indexed by ID once)
+    project_columns = {col.get('id'): col for col in project_details.get('column_values', [])}
+    
+    # Extract Post Code from dropdown_mknfpjbt column (Zip Code)
+    post_code = project_columns.get("dropdown_mknfpjbt", {}).get('text')
+    if post_code:
+        params["Post Code"] = post_code
+    
+    # Extract Project Name
+    title = _monday_column_value(project_columns.get("text3__1"))  # Project Name column
+    if title:
+        params["Drawing Title"] = title
     
     # Get today's date for Date Received (for amendments)
     from datetime import datetime
@@ -564,7 +1612,8 @@ def extract_parameters_from_monday_project(project_details):
     if project_details.get('subitems') and len(project_details['subitems']) > 0:
         # Use the most recent subitem (revision) for detailed information
         # Sort by ID in descending order to get the most recent one
-        latest_subitem = sorted(project_details['subitems'], key=lambda x: x['id'], reverse=True)[0]
+        # (IDs compared as numbers, so "10" ranks above "9")
+        latest_subitem = max(project_details['subitems'], key=lambda x: int(x['id']))
         
         print(f"DEBUG: Using latest subitem: {latest_subitem['name']}")
         
@@ -590,49 +1639,56 @@ def extract_parameters_from_monday_project(project_details):
             "mirror_1__1": "Revision",           # Revision column
         }
         
-        # Process each column value in the subitem
-        for col in latest_subitem.get('column_values', []):
-            col_id = col.get('id')
-            if col_id in column_mappings:
-                param_name = column_mappings[col_id]
-                
-                # Try to get text value or display_value for MirrorValue
-                if col.get('text') and col.get('text') != "None":
-                    params[param_name] = col.get('text')
-                elif col.get('__typename') == "MirrorValue" and col.get('display_value'):
-                    params[param_name] = col.get('display_value')
+        # Index the subitem's columns by ID once, then look each mapping up
+        columns = {col.get('id'): col for col in latest_subitem.get('column_values', [])}
+        
+        # Process each mapped column value in the subitem
+        for col_id, param_name in column_mappings.items():
+            value = _monday_column_value(columns.get(col_id))
+            if value:
+                params[param_name] = value
         
         # Special handling for certain parameters like Target U-Value that might come from different sources
         # From the Postman response, we can see mirror034__1 is actually "% Wasteage" not "Target U-Value"
         # Let's map it correctly
-        for col in latest_subitem.get('column_values', []):
-            if col.get('id') == "mirror034__1" and (col.get('text') or (col.get('__typename') == "MirrorValue" and col.get('display_value'))):
-                value = col.get('text') if col.get('text') else col.get('display_value')
-                params["Target U-Value"] = value
+        value = _monday_column_value(columns.get("mirror034__1"))
+        if value:
+            params["Target U-Value"] = value
     
     return params
 
+def _monday_column_value(col):
+    """A Monday.com column's text, else a MirrorValue's display_value; None when empty"""
+    if not col:
+        return None
+    text = col.get('text')
+    if text and text != "None":
+        return text
+    if col.get('__typename') == "MirrorValue":
+        return col.get('display_value') or None
+    return None
+
+# Insulation product names (as they appear in enquiries) by the category header used on drawings
+INSULATION_MAPPINGS = {
+    "TissueFaced PIR": ["TT47", "TR27", "Glass Tissue PIR", "Powerdeck F", "Adhered", "MG", "TR/MG", "FR/MG", "BauderPIR FA-TE", "Evatherm A", "Hytherm ADH"],
+    "TorchOn PIR": ["TT44", "TR24", "Torched", "Powerdeck U", "Torched", "BGM", "TR/BGM", "FR/BGM", "BauderPIR FA"],
+    "FoilFaced PIR": ["TT46", "TR26", "Foil", "Powerdeck Eurodeck", "Mech Fixed", "ALU", "TR/ALU", "FR/ALU", "Aluminium Faced"],
+    "ROCKWOOL HardRock MultiFix DD": ["Mineral wool", "Hardrock", "stonewool", "stone wool", "rock wool", "bauderrock"],
+    "Foamglas T3+": ["Cellular Glass", "foamed glass", "Bauderglas"],
+    "EPS": ["Expanded Polystrene"],
+    "XPS": ["Extruded Polystyrene"]
+}
+# (lowercased product, category) pairs in lookup order, built once
+_INSULATION_LOOKUP = [(product.lower(), category) for category, products in INSULATION_MAPPINGS.items() for product in products]
+
 def map_tapered_insulation_value(value):
     """Maps specific insulation product values to their category headers"""
-    
-    # Define lookup tables based on the image data
-    insulation_mappings = {
-        "TissueFaced PIR": ["TT47", "TR27", "Glass Tissue PIR", "Powerdeck F", "Adhered", "MG", "TR/MG", "FR/MG", "BauderPIR FA-TE", "Evatherm A", "Hytherm ADH"],
-        "TorchOn PIR": ["TT44", "TR24", "Torched", "Powerdeck U", "Torched", "BGM", "TR/BGM", "FR/BGM", "BauderPIR FA"],
-        "FoilFaced PIR": ["TT46", "TR26", "Foil", "Powerdeck Eurodeck", "Mech Fixed", "ALU", "TR/ALU", "FR/ALU", "Aluminium Faced"],
-        "ROCKWOOL HardRock MultiFix DD": ["Mineral wool", "Hardrock", "stonewool", "stone wool", "rock wool", "bauderrock"],
-        "Foamglas T3+": ["Cellular Glass", "foamed glass", "Bauderglas"],
-        "EPS": ["Expanded Polystrene"],
-        "XPS": ["Extruded Polystyrene"]
-    }
-    
     # Check if value exactly matches or contains any of the lookup values
     if value and value != "Not found":
-        original_value = value
-        for category, products in insulation_mappings.items():
-            for product in products:
-                if product.lower() in value.lower() or value.lower() in product.lower():
-                    return category
+        value_lower = value.lower()
+        for product, category in _INSULATION_LOOKUP:
+            if product in value_lower or value_lower in product:
+                return category
     
     # Return original value if no match found
-    return value
\ No newline at end of file
+    return value